@@ -1,40 +1,35 @@
 # Handle ai features
 
-import os
-from openai import OpenAI
 import discord
 from discord.ext import commands
 from discord import app_commands
-from bot.config import openrouter_api_key
-import asyncio
+from bot.utils.llm import get_llm_gateway
+from bot.utils.llm_cache import get_llm_cache
+
+ASK_MODEL = "google/gemma-3n-e2b-it:free"
+# Bump when the way questions are asked changes, so cached answers are not reused
+ASK_PROMPT_VERSION = 1
 
 class AiCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.ai_client = OpenAI(
-            base_url="https://openrouter.ai/api/v1",
-            api_key=openrouter_api_key,
-        )
+        self.llm_gateway = get_llm_gateway()
+        self.llm_cache = get_llm_cache()
 
-    def ask_gemma_3n_2b(self, question: str) -> str:
+    # Answers are cached, so asking the same question again does not call the model
+    async def async_ask_gemma_3n_2b(self, question: str) -> str:
+        answer = self.llm_cache.get(ASK_MODEL, ASK_PROMPT_VERSION, question)
+        if answer is not None:
+            return answer
         try:
-            completion = self.ai_client.chat.completions.create(
-                model="google/gemma-3n-e2b-it:free",
-                messages=[
-                    {
-                    "role": "user",
-                    "content": question
-                    }
-                ]
-            )
-            return completion.choices[0].message.content
+            answer = await self.llm_gateway.complete(question, model=ASK_MODEL)
+            if answer:
+                self.llm_cache.put(ASK_MODEL, ASK_PROMPT_VERSION, question, answer)
+            return answer
         except Exception as e:
             print(f"Error while asking Gemma 3n 2B: {e}")
             return "An error occurred while using the AI. PS. this feature is unfortunately easy to break."
 
-    async def async_ask_gemma_3n_2b(self, question: str) -> str:
-        return await asyncio.to_thread(self.ask_gemma_3n_2b, question)
-
     # Setup a testing ask command
 
     @app_commands.command(name='askai', description="Ask something to Gemma 3n 2B! Likely to break. No memories.")
@@ -8,17 +8,51 @@ import re
 from discord.ext import commands
 from discord import app_commands
 import asyncio
-from bot.utils.memory import save_jam_data, load_jam_data, clear_jam_data, save, load
-from openai import OpenAI
-from bot.config import openrouter_api_key
+import json
+import time
+from typing import Optional
+from bot.utils.memory import save_jam_data, load_jam_data, clear_jam_data, save, load, load_items, \
+    sync_item, remove_item
+from bot.utils.llm import get_llm_gateway
+from bot.utils.llm_cache import get_llm_cache
+from bot.utils.theme_index import ThemeIndex
+
+THEME_MODEL = "google/gemma-3n-e2b-it:free"
+# Bump when the theme refining prompts change, so cached refinements are not reused
+THEME_PROMPT_VERSION = 1
+# Theme suggestions sent to the model per request, and batch requests in flight at once
+THEME_REFINE_BATCH_SIZE = 20
+THEME_REFINE_CONCURRENCY = 4
+# Options in a theme poll, and extra themes refined in case some refine to the same theme
+THEME_POLL_SIZE = 10
+THEME_REFINE_MARGIN = 5
+# Seconds between progress updates while refining themes
+THEME_PROGRESS_INTERVAL = 1.5
+# Thread id -> guild id of the theme collection threads whose themes are indexed live
+THEME_THREADS_PATH = "theme_collection_threads"
 
 class ItchCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.ai_client = OpenAI(
-            base_url="https://openrouter.ai/api/v1",
-            api_key=openrouter_api_key,
-        )
+        self.llm_gateway = get_llm_gateway()
+        self.llm_cache = get_llm_cache()
+        self.theme_threads = load_items(THEME_THREADS_PATH)
+        # Guild id -> ThemeIndex, loaded on first use
+        self.theme_indexes = {}
+        # Threads whose messages from while the bot was offline were read; until then new messages
+        # do not move the latest message seen, or the ones in between would be skipped
+        self.caught_up_theme_threads = set()
+        self.catch_up_task = None
+
+    async def cog_load(self):
+        # The bot is already ready when cogs are added, so an on_ready listener would not run
+        self.catch_up_task = asyncio.create_task(self._catch_up_theme_indexes())
+
+    def cog_unload(self):
+        if self.catch_up_task is not None:
+            self.catch_up_task.cancel()
+        for theme_index in self.theme_indexes.values():
+            theme_index.flush()
 
     # Create a command group for jam-related commands
     jam = app_commands.Group(name='jam', description='Game jam tracking commands')
@@ -244,8 +278,22 @@ class ItchCog(commands.Cog):
 
         return member.guild_permissions.administrator
 
+    def _clean_refined_theme(self, refined) -> Optional[str]:
+        """Clean up a refined theme from the model, or None if the reply is not a usable theme"""
+        if not isinstance(refined, str):
+            return None
+        refined = refined.strip()
+        # Clean up the response (remove quotes, extra text)
+        refined = re.sub(r'^["\']*|["\']*$', '', refined)
+        refined = re.sub(r'\n.*', '', refined)  # Take only first line
+
+        return refined if 0 < len(refined) <= 50 else None
+
     async def _refine_theme_with_ai(self, raw_theme: str) -> str:
         """Use AI to refine a raw theme suggestion into a proper game jam theme"""
+        refined = self.llm_cache.get(THEME_MODEL, THEME_PROMPT_VERSION, raw_theme)
+        if refined is not None:
+            return refined
         try:
             prompt = f"""Convert this user suggestion into a proper game jam theme. Make it:
 - 1-4 words maximum
@@ -257,65 +305,233 @@ User suggestion: "{raw_theme}"
 
 Reply with only the refined theme, no explanation."""
 
-            completion = self.ai_client.chat.completions.create(
-                model="google/gemma-3n-e2b-it:free",
-                messages=[{"role": "user", "content": prompt}]
-            )
-
-            refined = completion.choices[0].message.content.strip()
-            # Clean up the response (remove quotes, extra text)
-            refined = re.sub(r'^["\']*|["\']*$', '', refined)
-            refined = re.sub(r'\n.*', '', refined)  # Take only first line
-
-            return refined if len(refined) <= 50 else raw_theme[:50]
+            refined = self._clean_refined_theme(await self.llm_gateway.complete(prompt, model=THEME_MODEL))
+            if refined is None:
+                # Not cached, so the suggestion is refined again next time
+                return raw_theme[:50]
+            self.llm_cache.put(THEME_MODEL, THEME_PROMPT_VERSION, raw_theme, refined)
+            return refined
         except Exception as e:
             print(f"Error refining theme with AI: {e}")
             return raw_theme[:50]  # Fallback to truncated original
 
-    async def _extract_themes_from_thread(self, thread: discord.Thread) -> list:
-        """Extract and rank themes from thread messages based on 👎 reactions"""
-        themes = []
-
+    async def _refine_theme_batch_with_ai(self, raw_themes: list) -> list:
+        """Refine several theme suggestions in one request, answered as a JSON array"""
         try:
-            # Get all messages from the thread
-            async for message in thread.history(limit=None, oldest_first=True):
-                # Skip bot messages and the initial pinned message
-                if message.author.bot:
-                    continue
-
-                # Skip very short messages (likely not themes)
-                if len(message.content.strip()) < 2:
-                    continue
-
-                # Count 👍 reactions
-                thumbs_up_count = 0
-                for reaction in message.reactions:
-                    if str(reaction.emoji) == "👍":
-                        thumbs_up_count = reaction.count
-                        break
-
-                # Clean the message content
-                theme_content = re.sub(r'\s+', ' ', message.content.strip())
-
-                # Refine theme with AI
-                refined_theme = await self._refine_theme_with_ai(theme_content)
-
-                themes.append({
-                    'original': theme_content,
-                    'refined': refined_theme,
-                    'reactions': thumbs_up_count,
-                    'author': str(message.author),
-                    'message_id': message.id,
-                    'created_at': message.created_at.isoformat()
-                })
+            prompt = f"""Convert each of these user suggestions into a proper game jam theme. Make each:
+- 1-4 words maximum
+- Clear and specific
+- Suitable for game development
+- Creative but not overly complex
 
-            # Sort by reaction count (descending), then by creation time (ascending)
-            themes.sort(key=lambda x: (-x['reactions'], x['created_at']))
+User suggestions (JSON array): {json.dumps(raw_themes, ensure_ascii=False)}
+
+Reply with only a JSON array of {len(raw_themes)} strings, the refined themes in the same order, no explanation."""
+
+            reply = await self.llm_gateway.complete(prompt, model=THEME_MODEL)
+            # Models often wrap JSON in a code block
+            match = re.search(r'\[.*\]', reply, re.DOTALL)
+            refined_themes = json.loads(match.group(0)) if match else None
+            if not isinstance(refined_themes, list) or len(refined_themes) != len(raw_themes):
+                raise ValueError(f"expected a JSON array of {len(raw_themes)} themes")
+            cleaned_themes = []
+            for raw_theme, refined in zip(raw_themes, refined_themes):
+                refined = self._clean_refined_theme(refined)
+                if refined is None:
+                    # Only usable replies are cached; the rest fall back to the raw suggestion
+                    cleaned_themes.append(raw_theme[:50])
+                else:
+                    self.llm_cache.put(THEME_MODEL, THEME_PROMPT_VERSION, raw_theme, refined)
+                    cleaned_themes.append(refined)
+            return cleaned_themes
+        except Exception as e:
+            # One suggestion per request instead
+            print(f"Error refining theme batch with AI, refining one by one: {e}")
+            return list(await asyncio.gather(*[self._refine_theme_with_ai(raw_theme) for raw_theme in raw_themes]))
+
+    async def _refine_themes_with_ai(self, raw_themes: list, progress=None) -> list:
+        """Refine theme suggestions in batches, a few batches at a time, reusing cached refinements.
+        progress is an optional coroutine function called with (refined count, total count)."""
+        refined_themes = [self.llm_cache.get(THEME_MODEL, THEME_PROMPT_VERSION, raw_theme) for raw_theme in raw_themes]
+        uncached_indexes = [i for i, refined in enumerate(refined_themes) if refined is None]
+        uncached_themes = [raw_themes[i] for i in uncached_indexes]
+        semaphore = asyncio.Semaphore(THEME_REFINE_CONCURRENCY)
+        refined_count = len(raw_themes) - len(uncached_themes)
+
+        async def refine_batch(batch):
+            nonlocal refined_count
+            async with semaphore:
+                refined_batch = await self._refine_theme_batch_with_ai(batch)
+            refined_count += len(batch)
+            if progress is not None:
+                await progress(refined_count, len(raw_themes))
+            return refined_batch
+
+        batches = [uncached_themes[i:i + THEME_REFINE_BATCH_SIZE]
+                   for i in range(0, len(uncached_themes), THEME_REFINE_BATCH_SIZE)]
+        refined_batches = await asyncio.gather(*[refine_batch(batch) for batch in batches])
+        for i, refined in zip(uncached_indexes, [refined for refined_batch in refined_batches for refined in refined_batch]):
+            refined_themes[i] = refined
+        return refined_themes
+
+    def _get_theme_index(self, guild_id: int) -> ThemeIndex:
+        """Get the live theme index of a guild"""
+        if guild_id not in self.theme_indexes:
+            self.theme_indexes[guild_id] = ThemeIndex(f"theme_index_{guild_id}")
+        return self.theme_indexes[guild_id]
+
+    def _is_theme_suggestion(self, message: discord.Message) -> bool:
+        """Skip bot messages (including the initial pinned message) and very short messages"""
+        return not message.author.bot and len(message.content.strip()) >= 2
+
+    def _index_theme_message(self, guild_id: int, message: discord.Message):
+        """Add a thread message to the theme index of a guild, with its 👍 count"""
+        thumbs_up_count = 0
+        for reaction in message.reactions:
+            if str(reaction.emoji) == "👍":
+                thumbs_up_count = reaction.count
+                break
+
+        self._get_theme_index(guild_id).add(
+            message.id,
+            re.sub(r'\s+', ' ', message.content.strip()),
+            str(message.author),
+            message.created_at.isoformat(),
+            thumbs_up_count
+        )
 
+    def _start_theme_index(self, guild_id: int, thread_id: int):
+        """Start indexing the themes of a collection thread live"""
+        self._get_theme_index(guild_id).clear()
+        self.theme_threads[thread_id] = guild_id
+        self.caught_up_theme_threads.add(thread_id)
+        sync_item(thread_id, guild_id, THEME_THREADS_PATH)
+
+    def _stop_theme_index(self, guild_id: int, thread_id: int):
+        """Stop indexing a collection thread and drop its themes"""
+        self._get_theme_index(guild_id).clear()
+        self.caught_up_theme_threads.discard(thread_id)
+        if self.theme_threads.pop(thread_id, None) is not None:
+            remove_item(thread_id, THEME_THREADS_PATH)
+
+    async def _catch_up_theme_index(self, guild_id: int, thread: discord.Thread):
+        """Index the messages posted after the latest one seen, e.g. while the bot was offline.
+        Collections started before themes were indexed live are read from the start, once.
+        Edits, deletions and reactions to older messages made while offline are not caught up."""
+        if thread.id not in self.theme_threads:
+            self._start_theme_index(guild_id, thread.id)
+        theme_index = self._get_theme_index(guild_id)
+        after = None if theme_index.last_message_id is None else discord.Object(id=theme_index.last_message_id)
+        try:
+            async for message in thread.history(limit=None, after=after, oldest_first=True):
+                if self._is_theme_suggestion(message):
+                    self._index_theme_message(guild_id, message)
+                theme_index.see_message(message.id)
+            self.caught_up_theme_threads.add(thread.id)
         except Exception as e:
-            print(f"Error extracting themes from thread: {e}")
+            print(f"Error indexing themes from thread: {e}")
+
+    async def _catch_up_theme_indexes(self):
+        """Catch up the theme index of every collection thread once the bot is ready"""
+        await self.bot.wait_until_ready()
+        for thread_id, guild_id in list(self.theme_threads.items()):
+            try:
+                thread = self.bot.get_channel(thread_id) or await self.bot.fetch_channel(thread_id)
+            except discord.HTTPException as e:
+                print(f"Error fetching theme collection thread {thread_id}: {e}")
+                continue
+            await self._catch_up_theme_index(guild_id, thread)
+
+    @commands.Cog.listener()
+    async def on_message(self, message: discord.Message):
+        guild_id = self.theme_threads.get(message.channel.id)
+        if guild_id is None:
+            return
+        if self._is_theme_suggestion(message):
+            self._index_theme_message(guild_id, message)
+        if message.channel.id in self.caught_up_theme_threads:
+            self._get_theme_index(guild_id).see_message(message.id)
+
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent):
+        guild_id = self.theme_threads.get(payload.channel_id)
+        if guild_id is None:
+            return
+        theme_index = self._get_theme_index(guild_id)
+        if not self._is_theme_suggestion(payload.message):
+            theme_index.remove(payload.message_id)
+        elif payload.message_id in theme_index:
+            theme_index.edit(payload.message_id, re.sub(r'\s+', ' ', payload.message.content.strip()))
+        else:
+            self._index_theme_message(guild_id, payload.message)
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        guild_id = self.theme_threads.get(payload.channel_id)
+        if guild_id is not None:
+            self._get_theme_index(guild_id).remove(payload.message_id)
+
+    @commands.Cog.listener()
+    async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent):
+        guild_id = self.theme_threads.get(payload.channel_id)
+        if guild_id is not None:
+            for message_id in payload.message_ids:
+                self._get_theme_index(guild_id).remove(message_id)
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
+        guild_id = self.theme_threads.get(payload.channel_id)
+        if guild_id is not None and str(payload.emoji) == "👍":
+            self._get_theme_index(guild_id).add_reactions(payload.message_id, 1)
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_remove(self, payload: discord.RawReactionActionEvent):
+        guild_id = self.theme_threads.get(payload.channel_id)
+        if guild_id is not None and str(payload.emoji) == "👍":
+            self._get_theme_index(guild_id).add_reactions(payload.message_id, -1)
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_clear(self, payload: discord.RawReactionClearEvent):
+        guild_id = self.theme_threads.get(payload.channel_id)
+        if guild_id is not None:
+            self._get_theme_index(guild_id).set_reactions(payload.message_id, 0)
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_clear_emoji(self, payload: discord.RawReactionClearEmojiEvent):
+        guild_id = self.theme_threads.get(payload.channel_id)
+        if guild_id is not None and str(payload.emoji) == "👍":
+            self._get_theme_index(guild_id).set_reactions(payload.message_id, 0)
+
+    async def _select_top_themes(self, theme_index: ThemeIndex, count=THEME_POLL_SIZE, progress=None) -> list:
+        """AI-refine indexed themes from the top until there are count distinct refined themes.
+        A theme that refines to the same theme as a higher ranked one is dropped, and more themes
+        are refined to replace it, so only about count themes are refined however long the thread is."""
+        top_themes = []
+        seen_themes = set()
+        cursor = None
+        refined_total = 0
+
+        while len(top_themes) < count:
+            window, cursor = theme_index.get_ranked(cursor, count - len(top_themes) + THEME_REFINE_MARGIN)
+            if not window:
+                break
+
+            async def window_progress(refined_count, total_count, refined_before=refined_total):
+                if progress is not None:
+                    await progress(refined_before + refined_count, refined_before + total_count)
+
+            refined_themes = await self._refine_themes_with_ai([theme['original'] for theme in window], window_progress)
+            refined_total += len(window)
+
+            for theme, refined_theme in zip(window, refined_themes):
+                theme['refined'] = refined_theme
+                key = refined_theme.casefold()
+                if key in seen_themes or len(top_themes) >= count:
+                    continue
+                seen_themes.add(key)
+                top_themes.append(theme)
 
-        return themes
+        return top_themes
 
     @jam.command(name='time', description="Get remaining time for an itch.io game jam")
     @app_commands.describe(jam_url="The itch.io jam URL (e.g., https://itch.io/jam/yourjam)")
@@ -628,6 +844,9 @@ Reply with only the refined theme, no explanation."""
                 reason="Theme collection for game jam"
             )
 
+            # Index suggestions and reactions as they come in
+            self._start_theme_index(guild_id, thread.id)
+
             # Default collection message
             if not collection_message:
                 collection_message = (
@@ -721,19 +940,36 @@ Reply with only the refined theme, no explanation."""
                 )
                 return
 
-            # Extract themes from thread
-            await interaction.followup.send("🔄 **Processing themes with AI...**")
-            themes = await self._extract_themes_from_thread(thread)
+            # Themes are indexed live; only messages posted while the bot was offline need reading
+            await self._catch_up_theme_index(guild_id, thread)
+            theme_index = self._get_theme_index(guild_id)
+            theme_count = len(theme_index)
+
+            progress_message = await interaction.followup.send("🔄 **Processing themes with AI...**", wait=True)
+            last_progress_update = 0
+
+            # Show how far refinement has got, editing at most every THEME_PROGRESS_INTERVAL seconds
+            async def show_progress(refined_count, total_count):
+                nonlocal last_progress_update
+                now = time.monotonic()
+                if refined_count < total_count and now - last_progress_update < THEME_PROGRESS_INTERVAL:
+                    return
+                last_progress_update = now
+                try:
+                    await progress_message.edit(
+                        content=f"🔄 **Processing themes with AI...** {refined_count}/{total_count}")
+                except discord.HTTPException as e:
+                    print(f"Error updating theme progress: {e}")
 
-            if not themes:
+            if not theme_count:
                 await interaction.followup.send(
                     "❌ **No themes found in the collection thread.**\n"
                     "Make sure people posted theme suggestions and reacted with 👍."
                 )
                 return
 
-            # Take top 10 themes
-            top_themes = themes[:10]
+            # Refine only the top themes, the ones that can make it into the poll
+            top_themes = await self._select_top_themes(theme_index, THEME_POLL_SIZE, show_progress)
 
             # Create Discord poll (max 10 options)
             poll_question = f"🎯 Vote for your favorite game jam theme!"
@@ -748,7 +984,7 @@ Reply with only the refined theme, no explanation."""
             # Create the poll message
             poll_embed = discord.Embed(
                 title="🗳️ Game Jam Theme Poll",
-                description=f"Vote for your favorite theme! Poll created from {len(themes)} suggestions.",
+                description=f"Vote for your favorite theme! Poll created from {theme_count} suggestions.",
                 color=0x00ff00
             )
 
@@ -773,18 +1009,19 @@ Reply with only the refined theme, no explanation."""
                 'active': False,
                 'ended_by': str(interaction.user),
                 'ended_at': datetime.now().isoformat(),
-                'themes_extracted': len(themes),
+                'themes_extracted': theme_count,
                 'top_themes': top_themes,
                 'poll_channel_id': poll_channel.id,
                 'poll_message_id': poll_message.id
             })
 
             self._save_theme_collection_data(guild_id, collection_data)
+            self._stop_theme_index(guild_id, thread.id)
 
             # Confirmation message
             await interaction.followup.send(
                 f"✅ **Theme poll created successfully!**\n\n"
-                f"📊 **Processed {len(themes)} themes** (AI-refined)\n"
+                f"📊 **Processed {theme_count} themes** (top {len(top_themes)} AI-refined)\n"
                 f"🗳️ **Poll:** {poll_message.jump_url}\n"
                 f"📍 **Channel:** {poll_channel.mention}\n"
                 f"🎯 **Top theme:** {top_themes[0]['refined']} ({top_themes[0]['reactions']} 👍)\n\n"
@@ -834,8 +1071,19 @@ Reply with only the refined theme, no explanation."""
             message = f"🟢 **Theme Collection Active**\n\n"
             message += f"🧵 **Thread:** <#{thread_id}>\n"
             message += f"👤 **Started by:** {started_by}\n"
-            message += f"📅 **Started:** {started_formatted}\n\n"
-            message += f"💡 **Use `/jam poll [channel]` to create poll from themes!**"
+            message += f"📅 **Started:** {started_formatted}\n"
+
+            if thread_id in self.theme_threads:
+                theme_index = self._get_theme_index(guild_id)
+                leading_themes, _ = theme_index.get_ranked(limit=3)
+                message += f"📊 **Suggestions so far:** {len(theme_index)}\n"
+                if leading_themes:
+                    message += f"\n🏆 **Leading themes:**\n"
+                    for i, theme in enumerate(leading_themes, 1):
+                        emoji = "🥇" if i == 1 else "🥈" if i == 2 else "🥉"
+                        message += f"{emoji} {theme['original'][:100]} ({theme['reactions']} 👍)\n"
+
+            message += f"\n💡 **Use `/jam poll [channel]` to create poll from themes!**"
 
         else:
             # Last collection results
@@ -1,22 +1,68 @@
 # Handle message queueing
-import re
+import time
 import pytz
+import random
+import re
+import asyncio
+import aiohttp
+from collections import deque, defaultdict
+from functools import lru_cache
 from typing import Optional
 from datetime import datetime, timedelta
-from dateutil import parser
+from dateutil.rrule import rrulestr
 
 from discord import Interaction
 
 import discord
-from discord.ext import commands, tasks
+from discord.ext import commands
 from discord import app_commands
 
-from bot.utils.memory import load_object, sync_object
+from bot.config import msg_catch_up_policy, msg_max_lateness_minutes
+from bot.utils.memory import load, load_object, sync_object, remove, load_items, sync_item, sync_items, \
+    append_log, append_logs, load_log, trim_log
+from bot.utils.scheduler import DeadlineScheduler
+from bot.utils.write_behind import WriteBehind
+from bot.utils.sorted_index import SortedIndex
+from bot.utils.permissions import PermissionRegistry
+from bot.utils.timeutil import DEFAULT_TIMEZONE, get_timezone, get_guild_timezone_name, parse_time_string, \
+    next_occurrence_hm, datetime_to_discord_short_datetime
 from enum import Enum
 
 MAX_MSGN_DISPLAY = 5
 MSG_MEMORY_PATH = "message_queue.pkl"
+# Pending jobs, one item per job id
+MSG_JOBS_PATH = "message_queue_jobs"
+# Finished (sent, failed or cancelled) jobs, append-only
+MSG_ARCHIVE_PATH = "message_queue_archive"
+MSG_ARCHIVE_MAX_JOBS = 1000
+MSG_ARCHIVE_MAX_AGE = timedelta(days=30)
+# Jobs that failed for good, append-only
+MSG_DEAD_LETTER_PATH = "message_queue_dead_letters"
+MSG_DEAD_LETTER_MAX_JOBS = 500
+# Transient failures are retried with jittered exponential backoff, up to MSG_MAX_ATTEMPTS sends in total
+MSG_MAX_ATTEMPTS = 6
+MSG_RETRY_BASE_DELAY = 5
+MSG_RETRY_MAX_DELAY = 15 * 60
+# At most this many messages are being sent at once, across all channels
+MSG_MAX_CONCURRENT_SENDS = 5
+# Delivery stats are kept for this many latest deliveries
+MSG_STATS_WINDOW = 1000
+# Messages missed while the bot was offline are sent at most this many per second after startup
+MSG_CATCH_UP_RATE = 2
+# Longest line per missed message in a catch-up summary
+MSG_SUMMARY_LINE_LENGTH = 150
+# Changes to the queue are written together at most this many seconds after they happen
+MSG_SAVE_DELAY = 0.5
 AUTH_USERS_PATH = "authorised_users.pkl"
+# Users and roles authorised to use the message queue, per guild
+AUTH_GRANTS_PATH = "message_queue_permissions"
+# Shorthands accepted for the repeat rule of a scheduled message
+REPEAT_SHORTHANDS = {
+    "daily": "FREQ=DAILY",
+    "weekly": "FREQ=WEEKLY",
+    "fortnightly": "FREQ=WEEKLY;INTERVAL=2",
+    "monthly": "FREQ=MONTHLY",
+}
 
 
 # enum for msg job status
@@ -24,27 +70,101 @@ class JobStatus(str, Enum):
     PENDING = "pending"
     SENT = "sent"
     ERROR = "error"
+    CANCELLED = "cancelled"
+    # missed while the bot was offline, and not sent by the catch-up policy
+    SKIPPED = "skipped"
+    SUMMARISED = "summarised"
+
+# Parsed recurrence rules are cached, since a series parses the same rule at every occurrence
+# Occurrences are computed in naive local time of the series' timezone, so they stay at the same wall clock time across DST changes
+@lru_cache(maxsize=256)
+def get_rrule(rule: str, dtstart_local: datetime):
+    return rrulestr(rule, dtstart=dtstart_local)
+
+_utc_until_pattern = re.compile(r"UNTIL=(\d{8}T\d{6})Z", re.IGNORECASE)
+
+# Series are expanded in local wall time, so dateutil rejects an UNTIL in UTC (RFC 5545's usual form)
+# and it is rewritten as the same instant in the series' timezone
+def localize_rrule_until(rule: str, timezone: str) -> str:
+    def to_local(match):
+        until_utc = pytz.utc.localize(datetime.strptime(match.group(1), "%Y%m%dT%H%M%S"))
+        return "UNTIL=" + until_utc.astimezone(get_timezone(timezone)).strftime("%Y%m%dT%H%M%S")
+    return _utc_until_pattern.sub(to_local, rule)
+
+class CatchUpPolicy(str, Enum):
+    SEND = "send"
+    SKIP = "skip"
+    SUMMARISE = "summarise"
 
 class MsgQueueCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        # keys of dict: [{id, channel_id, message, due_utc, status, author_id}]
-        self.jobs: list[dict] = []
+        # Pending jobs only, job id -> {id, channel_id, message, due_utc, status, author_id}
+        # Finished jobs are moved to the archive log
+        self.jobs: dict[int, dict] = {}
         self._next_id = 1
         self.queue_filename = MSG_MEMORY_PATH
-        state = load_object(self.queue_filename, default_value={"jobs": [], "next_id": 1})
+        # Changes waiting to be written: updated jobs, ids of finished jobs and the jobs to archive
+        self.dirty_jobs: dict[int, dict] = {}
+        self.finished_job_ids: set[int] = set()
+        self.finished_jobs: list[dict] = []
+        self.dead_letter_jobs: list[dict] = []
+        self.state_dirty = False
+        self.writer = WriteBehind(self._write_changes, delay=MSG_SAVE_DELAY)
+        # Pending and archived jobs by (due_utc, id), per guild under every combination of status, author and channel
+        # Archived jobs are kept here in the order they were archived, up to MSG_ARCHIVE_MAX_JOBS
+        self.job_index = SortedIndex()
+        self.history_sort_keys = deque()
+        # Pending jobs wait in the scheduler, which wakes up exactly when the next one is due
+        self.scheduler = DeadlineScheduler(self.deliver_jobs, before_start=self.bot.wait_until_ready)
+        # Jobs that were already due when loaded, drained at MSG_CATCH_UP_RATE once the bot is ready
+        # by the catch-up task, which first gives jobs saved without their guild one
+        self.overdue_job_ids: list[int] = []
+        self.catch_up_policy = CatchUpPolicy(msg_catch_up_policy)
+        self.max_lateness = timedelta(minutes=msg_max_lateness_minutes)
+        self.catch_up_task = None
+        # Due jobs wait in a queue per channel, each sent in order by its own worker task
+        self.channel_queues: dict[int, deque] = {}
+        self.channel_workers: dict[int, asyncio.Task] = {}
+        self.send_semaphore = asyncio.Semaphore(MSG_MAX_CONCURRENT_SENDS)
+        # Per guild, of the latest deliveries: time.monotonic() when sent, and seconds from due time to sent
+        self.delivery_times = defaultdict(lambda: deque(maxlen=MSG_STATS_WINDOW))
+        self.delivery_latencies = defaultdict(lambda: deque(maxlen=MSG_STATS_WINDOW))
+        # Per guild, of the latest sends, seconds the send call took, failed or not
+        self.send_latencies = defaultdict(lambda: deque(maxlen=MSG_STATS_WINDOW))
+        # Guild id -> count
+        self.count_sent = defaultdict(int)
+        self.count_errors = defaultdict(int)
+        self.count_retries = defaultdict(int)
+        state = load_object(self.queue_filename, default_value={"next_id": 1})
         try:
-            self.jobs = state.get("jobs", [])
-            for j in self.jobs:
-                if not isinstance(j.get("status"), JobStatus):
-                    j["status"] = JobStatus(j.get("status", JobStatus.PENDING))
+            if "jobs" in state:
+                self._migrate_legacy_jobs(state["jobs"])
+            self.jobs = load_items(MSG_JOBS_PATH)
+            now_utc = datetime.now(pytz.utc)
+            for j in self.jobs.values():
+                # missed while offline, these go through the catch-up policy instead
+                if j["due_utc"] <= now_utc:
+                    self.overdue_job_ids.append(j["id"])
+                else:
+                    self.scheduler.schedule(j["id"], j["due_utc"])
+                self._index_job(j)
             self._next_id = int(state.get("next_id", 1))
         except Exception as e:
             print(f"[msgqueue] load failed, starting fresh: {e}")
-        self.check_jobs.start()
-        self.authorised_users = load_object(AUTH_USERS_PATH)
-        if self.authorised_users is None:
-            self.authorised_users = []
+        if "jobs" in state:
+            sync_object({"next_id": self._next_id}, self.queue_filename)
+        trim_log(MSG_ARCHIVE_PATH, max_entries=MSG_ARCHIVE_MAX_JOBS, max_age=MSG_ARCHIVE_MAX_AGE)
+        for j in load_log(MSG_ARCHIVE_PATH):
+            j["status"] = JobStatus(j["status"])
+            self._index_history(j)
+        self.permissions = PermissionRegistry(AUTH_GRANTS_PATH)
+        # old versions kept one list of user ids for every guild, which now become grants in every guild
+        legacy_authorised_users = load(AUTH_USERS_PATH)
+        if legacy_authorised_users is not None:
+            for user_id in legacy_authorised_users["data"] or []:
+                self.permissions.grant_user(None, user_id)
+            remove(AUTH_USERS_PATH)
 
     # Send message at scheduled time
     @app_commands.command(name="messagequeuing",
@@ -52,9 +172,11 @@ class MsgQueueCog(commands.Cog):
     @app_commands.describe(
         channel="Channel to send in",
         message="Message to send",
-        date="Optional scheduled date YYYY-MM-DD (local Melbourne). If time omitted, send at 12AM",
-        time_hm="Optional scheduled time HH:MM (local Melbourne). If date omitted, uses next occurrence."
+        date="Optional scheduled date YYYY-MM-DD (server timezone). If time omitted, send at 12AM",
+        time_hm="Optional scheduled time HH:MM (server timezone). If date omitted, uses next occurrence.",
+        repeat="Optional repeat: daily, weekly, fortnightly, monthly or an RRULE, e.g. FREQ=WEEKLY;BYDAY=MO,TH"
     )
+    @app_commands.guild_only()
     async def messagequeuing(
         self,
         interaction: discord.Interaction,
@@ -62,18 +184,25 @@ class MsgQueueCog(commands.Cog):
         message: str,
         date: Optional[str] = None,
         time_hm: Optional[str] = None,
+        repeat: Optional[str] = None,
     ):
-        if interaction.user.id not in self.authorised_users:
+        if not self.permissions.is_granted(interaction.user):
             return await interaction.response.send_message(
             "(X) You don’t have permission to schedule messages here.", ephemeral=True
         )
+        # permissions are per guild, so messages can only be scheduled for this guild's channels
+        if channel.guild.id != interaction.guild_id:
+            return await interaction.response.send_message(
+                "(X) You can only schedule messages for channels in this server.", ephemeral=True
+            )
+        timezone = get_guild_timezone_name(interaction.guild_id)
         try:
             if date and time_hm:
-                local_dt = self.parse_time_string(f"{date}T{time_hm}")
+                local_dt = parse_time_string(f"{date}T{time_hm}", timezone=timezone)
             elif time_hm:
-                local_dt = self.next_occurrence_hm_local(time_hm)
+                local_dt = next_occurrence_hm(time_hm, timezone)
             elif date:
-                local_dt = self.parse_time_string(date)
+                local_dt = parse_time_string(date, timezone=timezone)
             else:
                 return await interaction.response.send_message(
                     "(X) Provide either `date` + `time_hm`, `time_hm`. or `date` to schedule your message",
@@ -82,103 +211,518 @@ class MsgQueueCog(commands.Cog):
             due_utc = local_dt.astimezone(pytz.utc)
         except Exception as e:
             return await interaction.response.send_message(f"(X) Time parse error: {e}", ephemeral=True)
+        recurrence = None
+        if repeat:
+            try:
+                recurrence = self.parse_recurrence(repeat, local_dt, timezone)
+                # the series starts at its first occurrence, which is local_dt only if the rule includes it
+                local_dt = self.get_first_occurrence(recurrence)
+                due_utc = local_dt.astimezone(pytz.utc)
+            except Exception as e:
+                return await interaction.response.send_message(f"(X) Repeat rule error: {e}", ephemeral=True)
 
         # Enqueue in memory
         job = {
             "id": self._next_id,
+            "guild_id": channel.guild.id,
             "channel_id": channel.id,
             "message": message,
             "due_utc": due_utc,
             "status": JobStatus.PENDING,
             "author_id": interaction.user.id,
+            "recurrence": recurrence,
         }
         self._next_id += 1
-        self.jobs.append(job)
+        self.jobs[job["id"]] = job
+        self.scheduler.schedule(job["id"], due_utc)
+        self._index_job(job)
+        self._save_job(job)
         self._save_state()
+        # the user is told the message is queued, so make sure it is
+        self.writer.flush()
 
         # Confirm to the user
+        repeat_label = f", repeating `{recurrence['rule']}`" if recurrence else ""
         await interaction.response.send_message(
-            f"Queued **#{job['id']}** for {self.datetime_to_discord_short_datetime(local_dt)} in {channel.mention}.",
+            f"Queued **#{job['id']}** for {datetime_to_discord_short_datetime(local_dt)} in {channel.mention}"
+            f"{repeat_label}.",
             ephemeral=True
         )
 
-    def next_occurrence_hm_local(self, hm: str) -> datetime:
-        fmt = "%H:%M"
-        t = datetime.strptime(hm, fmt).time()
-        now = self.current_time()
-        cand = now.replace(hour=t.hour, minute=t.minute, second=0)
-        if cand <= now:
-            cand += timedelta(days=1)
-        return cand
+    # Recurrence of a series starting at local_dt, from a repeat shorthand or RRULE string
+    def parse_recurrence(self, repeat: str, local_dt: datetime, timezone=DEFAULT_TIMEZONE) -> dict:
+        rule = REPEAT_SHORTHANDS.get(repeat.strip().lower(), repeat.strip())
+        if rule.upper().startswith("RRULE:"):
+            rule = rule[len("RRULE:"):]
+        rule = localize_rrule_until(rule, timezone)
+        recurrence = {
+            "rule": rule,
+            "dtstart": local_dt.astimezone(get_timezone(timezone)).replace(tzinfo=None),
+            "timezone": timezone,
+            "occurrence": 1,
+        }
+        # Fail now on rules that do not parse or never occur
+        self.get_first_occurrence(recurrence)
+        return recurrence
+
+    # First occurrence of a recurrence at or after its start, in its timezone
+    def get_first_occurrence(self, recurrence: dict) -> datetime:
+        first_local = get_rrule(recurrence["rule"], recurrence["dtstart"]).after(recurrence["dtstart"], inc=True)
+        if first_local is None:
+            raise ValueError("the rule has no occurrences")
+        return get_timezone(recurrence["timezone"]).localize(first_local)
+
+    # Next due time of a recurring job after its current one, skipping occurrences that have
+    # already passed, or None if the series is over
+    def get_next_occurrence(self, job: dict) -> Optional[datetime]:
+        recurrence = job["recurrence"]
+        tz = get_timezone(recurrence["timezone"])
+        after_utc = max(job["due_utc"], datetime.now(pytz.utc))
+        after_local = after_utc.astimezone(tz).replace(tzinfo=None)
+        next_local = get_rrule(recurrence["rule"], recurrence["dtstart"]).after(after_local)
+        if next_local is None:
+            return None
+        return tz.localize(next_local).astimezone(pytz.utc)
 
-    # save current queue state
+    # the methods below only buffer changes, which the writer saves together shortly after
+    # save queue counters
     def _save_state(self):
+        self.state_dirty = True
+        self.writer.mark_dirty()
+
+    def _save_job(self, job: dict):
+        self.dirty_jobs[job["id"]] = job
+        self.finished_job_ids.discard(job["id"])
+        self.writer.mark_dirty()
+
+    # index keys of a job: its guild with every combination of its status, author and channel,
+    # None meaning any
+    def get_index_keys(self, job: dict) -> list:
+        return [(job.get("guild_id"), status, author_id, channel_id)
+            for status in (None, job["status"])
+            for author_id in (None, job.get("author_id"))
+            for channel_id in (None, job["channel_id"])]
+
+    # guild of a job; jobs saved before jobs recorded their guild get it from their channel, if it is known
+    def get_job_guild_id(self, job: dict) -> Optional[int]:
+        if job.get("guild_id") is None:
+            channel = self.bot.get_channel(job["channel_id"])
+            if channel is not None and getattr(channel, "guild", None) is not None:
+                job["guild_id"] = channel.guild.id
+        return job.get("guild_id")
+
+    def _index_job(self, job: dict):
+        self.job_index.add((job["due_utc"], job["id"]), self.get_index_keys(job), job)
+
+    # index an archived job, replacing its pending entry, and drop the oldest archived ones past the limit
+    def _index_history(self, job: dict):
+        sort_key = (job["due_utc"], job["id"])
+        self.job_index.add(sort_key, self.get_index_keys(job), job)
+        self.history_sort_keys.append(sort_key)
+        while len(self.history_sort_keys) > MSG_ARCHIVE_MAX_JOBS:
+            old_sort_key = self.history_sort_keys.popleft()
+            old_job = self.job_index.get(old_sort_key)
+            if old_job is not None and old_job["status"] != JobStatus.PENDING:
+                self.job_index.remove(old_sort_key)
+
+    # move a finished job out of the pending jobs and into the archive
+    def _archive_job(self, job: dict):
+        self.jobs.pop(job["id"], None)
+        job["finished_utc"] = datetime.now(pytz.utc)
+        self._index_history(job)
+        self.dirty_jobs.pop(job["id"], None)
+        self.finished_job_ids.add(job["id"])
+        self.finished_jobs.append(job)
+        self.writer.mark_dirty()
+
+    # write every buffered change
+    # delivery is at least once: a job stays pending in memory until the next write, so a crash
+    # within MSG_SAVE_DELAY of a send delivers that message again on restart.
+    # finished jobs leave the pending jobs before they reach the archive, so a crash between the
+    # two writes can lose an archive entry but does not send the message again
+    def _write_changes(self):
+        dirty_jobs, self.dirty_jobs = self.dirty_jobs, {}
+        finished_job_ids, self.finished_job_ids = self.finished_job_ids, set()
+        finished_jobs, self.finished_jobs = self.finished_jobs, []
+        dead_letter_jobs, self.dead_letter_jobs = self.dead_letter_jobs, []
+        state_dirty, self.state_dirty = self.state_dirty, False
         try:
-            sync_object({"jobs": self.jobs, "next_id": self._next_id}, self.queue_filename)
+            if dirty_jobs or finished_job_ids:
+                sync_items(dirty_jobs, MSG_JOBS_PATH, removed_keys=finished_job_ids)
+            if finished_jobs:
+                append_logs(finished_jobs, MSG_ARCHIVE_PATH)
+                trim_log(MSG_ARCHIVE_PATH, max_entries=MSG_ARCHIVE_MAX_JOBS, max_age=MSG_ARCHIVE_MAX_AGE)
+            if dead_letter_jobs:
+                append_logs(dead_letter_jobs, MSG_DEAD_LETTER_PATH)
+                trim_log(MSG_DEAD_LETTER_PATH, max_entries=MSG_DEAD_LETTER_MAX_JOBS)
+            if state_dirty:
+                sync_object({"next_id": self._next_id}, self.queue_filename)
         except Exception as e:
             print(f"[msgqueue] save failed: {e}")
 
+    # keep a delivered occurrence of a recurring job in the archive and move the job to its next
+    # occurrence; the series stays a single job. Returns False if the series is over.
+    def _advance_recurring_job(self, job: dict) -> bool:
+        next_due_utc = self.get_next_occurrence(job)
+        if next_due_utc is None:
+            return False
+        occurrence = dict(job, finished_utc=datetime.now(pytz.utc))
+        self.finished_jobs.append(occurrence)
+        self._index_history(occurrence)
+        job["status"] = JobStatus.PENDING
+        job["due_utc"] = next_due_utc
+        job["attempts"] = 0
+        job.pop("last_error", None)
+        job["recurrence"] = dict(job["recurrence"], occurrence=job["recurrence"]["occurrence"] + 1)
+        self.scheduler.schedule(job["id"], next_due_utc)
+        self._index_job(job)
+        self._save_job(job)
+        return True
+
+    # old versions kept every job, finished or not, in one pickled list
+    def _migrate_legacy_jobs(self, jobs: list):
+        for j in jobs:
+            if not isinstance(j.get("status"), JobStatus):
+                j["status"] = JobStatus(j.get("status", JobStatus.PENDING))
+            if j["status"] == JobStatus.PENDING:
+                sync_item(j["id"], j, MSG_JOBS_PATH)
+            else:
+                append_log(j, MSG_ARCHIVE_PATH)
+
+    # start delivering once the cog is added
+    # the bot is already ready when cogs are added, so this is also where jobs get the guild they miss
+    async def cog_load(self):
+        self.scheduler.start()
+        self.catch_up_task = asyncio.create_task(self.catch_up())
+
     # offload cog
     def cog_unload(self):
-        self._save_state()
-        self.check_jobs.cancel()
+        self.scheduler.stop()
+        if self.catch_up_task is not None:
+            self.catch_up_task.cancel()
+        for worker in self.channel_workers.values():
+            worker.cancel()
+        self.writer.flush()
 
-    # check every minute if there's schedule message need to be sent
-    @tasks.loop(minutes=1)
-    async def check_jobs(self):
-        now_utc = datetime.now(pytz.utc)
-        due = [j for j in self.jobs if j["status"] == JobStatus.PENDING and j["due_utc"] <= now_utc]
+    # called by the scheduler with the ids of jobs that just became due
+    # jobs are handed to their channel's worker, so a slow channel does not hold up the others
+    async def deliver_jobs(self, job_ids: list):
+        due = [self.jobs[job_id] for job_id in job_ids
+            if job_id in self.jobs and self.jobs[job_id]["status"] == JobStatus.PENDING]
+        due.sort(key=lambda j: (j["due_utc"], j["id"]))
         for job in due:
-            ch = self.bot.get_channel(job["channel_id"])
-            if isinstance(ch, discord.TextChannel):
-                try:
-                    sender_label = ""
-                    author_id = job.get("author_id")
-                    sender_label = f"<@{author_id}>"
-
-                    await ch.send(f"{sender_label}: {job['message']}")
-                    job["status"] = JobStatus.SENT
-                except Exception:
-                    job["status"] = JobStatus.ERROR
-                finally:
-                    self._save_state()
-
-    # Print out first 5 schedule messages need to be sent
-    @app_commands.command(name="checkmessagequeue",
-                        description=" Print out all schedule messages need to be sent")
-    async def check_message_queue(self, interaction):
-        if interaction.user.id not in self.authorised_users:
+            channel_id = job["channel_id"]
+            self.channel_queues.setdefault(channel_id, deque()).append(job)
+            if channel_id not in self.channel_workers:
+                self.channel_workers[channel_id] = asyncio.create_task(self._deliver_channel(channel_id))
+
+    # handle the jobs that were missed while the bot was offline: those missed by less than the
+    # maximum lateness, or all of them under the send policy, are delivered in due order at
+    # MSG_CATCH_UP_RATE; the rest are skipped, or listed in one summary message per channel
+    async def catch_up(self):
+        await self.bot.wait_until_ready()
+        self._backfill_job_guilds()
+        overdue = [self.jobs[job_id] for job_id in self.overdue_job_ids if job_id in self.jobs]
+        self.overdue_job_ids = []
+        overdue.sort(key=lambda j: (j["due_utc"], j["id"]))
+        now_utc = datetime.now(pytz.utc)
+        to_send, missed = [], []
+        for job in overdue:
+            if self.catch_up_policy == CatchUpPolicy.SEND or now_utc - job["due_utc"] <= self.max_lateness:
+                to_send.append(job)
+            else:
+                missed.append(job)
+
+        if self.catch_up_policy == CatchUpPolicy.SUMMARISE:
+            missed_by_channel = {}
+            for job in missed:
+                missed_by_channel.setdefault(job["channel_id"], []).append(job)
+            for channel_id, jobs in missed_by_channel.items():
+                await self._send_summary(channel_id, jobs)
+                await asyncio.sleep(1 / MSG_CATCH_UP_RATE)
+        else:
+            for job in missed:
+                job["status"] = JobStatus.SKIPPED
+                self._finish_job(job)
+        if missed:
+            print(f"[msgqueue] {len(missed)} messages missed while offline, policy: {self.catch_up_policy.value}")
+
+        for job in to_send:
+            if self.jobs.get(job["id"]) is job:
+                await self.deliver_jobs([job["id"]])
+                await asyncio.sleep(1 / MSG_CATCH_UP_RATE)
+
+    # post one message listing the jobs of a channel that were missed, instead of each of them;
+    # if it cannot be posted, the jobs count a failed attempt like any other send
+    async def _send_summary(self, channel_id: int, jobs: list):
+        lines = [f"While I was offline, {len(jobs)} scheduled message(s) for this channel were missed:"]
+        for j in jobs:
+            text = j["message"] if len(j["message"]) <= MSG_SUMMARY_LINE_LENGTH \
+                else j["message"][:MSG_SUMMARY_LINE_LENGTH - 3] + "..."
+            lines.append(f"- <@{j['author_id']}>, due {datetime_to_discord_short_datetime(j['due_utc'])}: {text}")
+        try:
+            ch = await self._resolve_channel(channel_id)
+            # one message holds at most 2000 characters
+            chunk = ""
+            for line in lines:
+                if len(chunk) + len(line) + 1 > 2000:
+                    await ch.send(chunk)
+                    chunk = ""
+                chunk += line + "\n"
+            if chunk:
+                await ch.send(chunk)
+        except Exception as e:
+            print(f"[msgqueue] failed to send catch-up summary to {channel_id}: {e}")
+            for j in jobs:
+                if self.jobs.get(j["id"]) is j:
+                    self._handle_failed_job(j, e)
+            return
+        for j in jobs:
+            if self.jobs.get(j["id"]) is j:
+                j["status"] = JobStatus.SUMMARISED
+                self._finish_job(j)
+
+    async def _resolve_channel(self, channel_id: int) -> discord.TextChannel:
+        ch = self.bot.get_channel(channel_id)
+        if ch is None:
+            ch = await self.bot.fetch_channel(channel_id)
+        if not isinstance(ch, discord.TextChannel):
+            raise TypeError(f"<#{channel_id}> is not a text channel")
+        return ch
+
+    # send the due jobs of a channel one at a time, in order, until its queue is empty
+    async def _deliver_channel(self, channel_id: int):
+        queue = self.channel_queues[channel_id]
+        ch = None
+        try:
+            while queue:
+                job = queue.popleft()
+                # it may have been cancelled while waiting
+                if self.jobs.get(job["id"]) is not job:
+                    continue
+                # a job that failed transiently is retried here after its backoff, so the later jobs
+                # of the channel wait behind it and keep their order
+                while True:
+                    try:
+                        if ch is None:
+                            ch = await self._resolve_channel(channel_id)
+                    except Exception as e:
+                        retry_delay = self._record_failure(job, e)
+                    else:
+                        async with self.send_semaphore:
+                            retry_delay = await self._send_job(ch, job)
+                    if retry_delay is None:
+                        break
+                    await asyncio.sleep(retry_delay)
+                    # it may have been cancelled during the backoff
+                    if self.jobs.get(job["id"]) is not job:
+                        break
+        finally:
+            del self.channel_queues[channel_id]
+            del self.channel_workers[channel_id]
+
+    # send a job, returning the seconds to wait before retrying it, or None if it is done with
+    async def _send_job(self, ch: discord.TextChannel, job: dict) -> Optional[float]:
+        sender_label = ""
+        author_id = job.get("author_id")
+        sender_label = f"<@{author_id}>"
+
+        guild_id = self.get_job_guild_id(job)
+        start = time.perf_counter()
+        try:
+            await ch.send(f"{sender_label}: {job['message']}")
+        except Exception as e:
+            self.send_latencies[guild_id].append(time.perf_counter() - start)
+            return self._record_failure(job, e)
+        self.send_latencies[guild_id].append(time.perf_counter() - start)
+        job["status"] = JobStatus.SENT
+        self.count_sent[guild_id] += 1
+        self.delivery_times[guild_id].append(time.monotonic())
+        self.delivery_latencies[guild_id].append((datetime.now(pytz.utc) - job["due_utc"]).total_seconds())
+        self._finish_job(job)
+        return None
+
+    # index jobs saved before jobs recorded their guild under their guild, once the channels are known
+    def _backfill_job_guilds(self):
+        history_jobs = [self.job_index.get(sort_key) for sort_key in self.history_sort_keys]
+        for job in list(self.jobs.values()) + history_jobs:
+            if job is None or job.get("guild_id") is not None or self.get_job_guild_id(job) is None:
+                continue
+            self.job_index.add((job["due_utc"], job["id"]), self.get_index_keys(job), job)
+            if self.jobs.get(job["id"]) is job:
+                self._save_job(job)
+
+    # archive a job that will not be sent again, or move a recurring one to its next occurrence
+    def _finish_job(self, job: dict):
+        if not (job.get("recurrence") and self._advance_recurring_job(job)):
+            self._archive_job(job)
+
+    # Whether a failed send may succeed if tried again later
+    def is_transient_error(self, error: Exception) -> bool:
+        if isinstance(error, (discord.RateLimited, discord.DiscordServerError, discord.ConnectionClosed,
+                discord.GatewayNotFound, aiohttp.ClientError, asyncio.TimeoutError, ConnectionError)):
+            return True
+        return isinstance(error, discord.HTTPException) and (error.status == 429 or error.status >= 500)
+
+    # Seconds to wait before sending again after the given number of failed attempts
+    def get_retry_delay(self, attempts: int, error: Exception) -> float:
+        if isinstance(error, discord.RateLimited):
+            return error.retry_after + random.uniform(0, 1)
+        delay = min(MSG_RETRY_MAX_DELAY, MSG_RETRY_BASE_DELAY * 2 ** (attempts - 1))
+        # Jitter, so jobs that failed together are not retried together
+        return delay * random.uniform(0.5, 1.0)
+
+    # retry a job later if the failure is transient, otherwise move it to the dead letters
+    # count a failed attempt of a job; returns the seconds to wait before retrying it, or None if it
+    # failed for good and went to the dead letters
+    def _record_failure(self, job: dict, error: Exception) -> Optional[float]:
+        job["attempts"] = job.get("attempts", 0) + 1
+        job["last_error"] = f"{type(error).__name__}: {error}"
+        if self.is_transient_error(error) and job["attempts"] < MSG_MAX_ATTEMPTS:
+            self.count_retries[self.get_job_guild_id(job)] += 1
+            self._save_job(job)
+            return self.get_retry_delay(job["attempts"], error)
+        print(f"[msgqueue] job #{job['id']} failed after {job['attempts']} attempts: {job['last_error']}")
+        job["status"] = JobStatus.ERROR
+        self.count_errors[self.get_job_guild_id(job)] += 1
+        self.dead_letter_jobs.append(dict(job, failed_utc=datetime.now(pytz.utc)))
+        self._finish_job(job)
+        return None
+
+    # count a failed attempt of a job outside of a channel worker, retrying it through the scheduler
+    def _handle_failed_job(self, job: dict, error: Exception):
+        retry_delay = self._record_failure(job, error)
+        if retry_delay is not None:
+            self.scheduler.schedule(job["id"], datetime.now(pytz.utc) + timedelta(seconds=retry_delay))
+
+    # value at quantile q (0 to 1) of sorted values, by nearest rank
+    def get_percentile(self, sorted_values: list, q: float):
+        index = min(len(sorted_values) - 1, max(0, round(q * len(sorted_values)) - 1))
+        return sorted_values[index]
+
+    # Show delivery throughput and latency of the message queue in this server
+    @app_commands.command(name="messagequeuestats",
+                            description="Show how fast scheduled messages are being delivered.")
+    @app_commands.guild_only()
+    async def message_queue_stats(self, interaction: discord.Interaction):
+        if not self.permissions.is_granted(interaction.user):
             return await interaction.response.send_message(
             "(X) You don’t have permission to check messages scheduled here.", ephemeral=True
         )
-        now_utc = datetime.now(pytz.utc)
+        guild_id = interaction.guild_id
+        count_pending = sum(1 for j in self.jobs.values() if self.get_job_guild_id(j) == guild_id)
+        count_delivering = sum(1 for queue in self.channel_queues.values() for j in queue
+            if self.get_job_guild_id(j) == guild_id)
+        lines = [f"Sent: {self.count_sent[guild_id]}, failed: {self.count_errors[guild_id]}, "
+            f"retried: {self.count_retries[guild_id]}, pending: {count_pending}, being delivered: {count_delivering}"]
+        delivery_times = self.delivery_times[guild_id]
+        now = time.monotonic()
+        count_last_minute = sum(1 for t in delivery_times if now - t <= 60)
+        lines.append(f"Deliveries in the last minute: {count_last_minute} ({count_last_minute / 60:.2f}/s)")
+        if len(delivery_times) >= 2 and delivery_times[-1] > delivery_times[0]:
+            rate = (len(delivery_times) - 1) / (delivery_times[-1] - delivery_times[0])
+            lines.append(f"Deliveries over the latest {len(delivery_times)}: {rate:.2f}/s")
+        if self.delivery_latencies[guild_id]:
+            latencies = sorted(self.delivery_latencies[guild_id])
+            lines.append(f"Time to deliver after due: p50 {self.get_percentile(latencies, 0.5):.2f}s, "
+                f"p95 {self.get_percentile(latencies, 0.95):.2f}s, max {latencies[-1]:.2f}s")
+        if self.send_latencies[guild_id]:
+            latencies = sorted(self.send_latencies[guild_id])
+            lines.append(f"Send call latency: p50 {self.get_percentile(latencies, 0.5) * 1e3:.0f}ms, "
+                f"p95 {self.get_percentile(latencies, 0.95) * 1e3:.0f}ms")
+        await interaction.response.send_message("\n".join(lines), ephemeral=True)
 
-        # store all pending msgs
-        pending = [j for j in self.jobs if j["status"] == JobStatus.PENDING]
-        if not pending:
-            return await interaction.response.send_message("No pending messages in queue.", ephemeral=True)
+    # Show the latest messages that could not be delivered
+    @app_commands.command(name="checkdeadletters",
+                            description="Show the latest scheduled messages that could not be delivered.")
+    @app_commands.guild_only()
+    async def check_dead_letters(self, interaction: discord.Interaction):
+        if not self.permissions.is_granted(interaction.user):
+            return await interaction.response.send_message(
+            "(X) You don’t have permission to check messages scheduled here.", ephemeral=True
+        )
+        self.writer.flush()
+        # the dead letter log is capped at MSG_DEAD_LETTER_MAX_JOBS, so it is filtered in full
+        dead_letters = [j for j in load_log(MSG_DEAD_LETTER_PATH) if self.get_job_guild_id(j) == interaction.guild_id]
+        if not dead_letters:
+            return await interaction.response.send_message("No undelivered messages.", ephemeral=True)
+        count_dead_letters = len(dead_letters)
+        dead_letters = dead_letters[-MAX_MSGN_DISPLAY:]
+        lines = [f"Latest {len(dead_letters)} of {count_dead_letters} undelivered messages:"]
+        for j in reversed(dead_letters):
+            ts = datetime_to_discord_short_datetime(j["failed_utc"])
+            lines.append(f"**#{j['id']}** for <#{j['channel_id']}> failed on {ts} after {j['attempts']} "
+                f"attempt(s): `{j['last_error'][:200]}`")
+        await interaction.response.send_message("\n".join(lines), ephemeral=True)
 
-        # display in time order
-        pending.sort(key=lambda j: (j["due_utc"], j["id"]))
-        mel = pytz.timezone("Australia/Melbourne")
+    # Cancel a pending scheduled message
+    @app_commands.command(name="cancelqueuedmessage",
+                            description="Cancel a pending scheduled message.")
+    @app_commands.describe(job_id="Number of the queued message, as shown by /checkmessagequeue")
+    @app_commands.guild_only()
+    async def cancel_queued_message(self, interaction: discord.Interaction, job_id: int):
+        if not self.permissions.is_granted(interaction.user):
+            return await interaction.response.send_message(
+            "(X) You don’t have permission to cancel messages scheduled here.", ephemeral=True
+        )
+        job = self.jobs.get(job_id)
+        if job is None or job["status"] != JobStatus.PENDING or self.get_job_guild_id(job) != interaction.guild_id:
+            return await interaction.response.send_message(
+                f"(X) No pending message **#{job_id}** in queue.", ephemeral=True
+            )
+        job["status"] = JobStatus.CANCELLED
+        self.scheduler.cancel(job_id)
+        self._archive_job(job)
+        await interaction.response.send_message(f"Cancelled **#{job_id}**.", ephemeral=True)
 
-        msgN = min(MAX_MSGN_DISPLAY, len(pending))
-        lines = [f"Showing next {msgN} of {len(pending)} pending messages:"]
-        for j in pending[:MAX_MSGN_DISPLAY]:
-            local_dt = j["due_utc"].astimezone(mel)
-            ts = self.datetime_to_discord_short_datetime(local_dt)
-            author = f"<@{j['author_id']}>" if j.get("author_id") else "someone"
-            lines.append(f"{author} scheduled message **#{j['id']}** to be sent in <#{j['channel_id']}> on {ts}.")
+    # Page through scheduled messages, pending ones by default
+    @app_commands.command(name="checkmessagequeue",
+                        description=" Print out all schedule messages need to be sent")
+    @app_commands.describe(
+        status="Only messages with this status (default: pending)",
+        author="Only messages scheduled by this user",
+        channel="Only messages for this channel"
+    )
+    @app_commands.choices(status=[app_commands.Choice(name=s.value, value=s.value) for s in JobStatus])
+    @app_commands.guild_only()
+    async def check_message_queue(
+        self,
+        interaction: discord.Interaction,
+        status: Optional[app_commands.Choice[str]] = None,
+        author: Optional[discord.User] = None,
+        channel: Optional[discord.TextChannel] = None,
+    ):
+        if not self.permissions.is_granted(interaction.user):
+            return await interaction.response.send_message(
+            "(X) You don’t have permission to check messages scheduled here.", ephemeral=True
+        )
+        job_status = JobStatus(status.value) if status else JobStatus.PENDING
+        index_key = (interaction.guild_id, job_status, author.id if author else None, channel.id if channel else None)
+        if self.job_index.count(index_key) == 0:
+            return await interaction.response.send_message(f"No {job_status.value} messages in queue.", ephemeral=True)
+        # pending messages in time order, finished ones latest first
+        view = JobPageView(self, index_key, descending=job_status != JobStatus.PENDING, user_id=interaction.user.id)
+        await interaction.response.send_message(view.render(), view=view, ephemeral=True)
 
-        if len(pending) > MAX_MSGN_DISPLAY:
-            lines.append(f"...and {len(pending) - MAX_MSGN_DISPLAY} more")
+    # one line describing a job, for listings
+    def format_job_line(self, j: dict) -> str:
+        ts = datetime_to_discord_short_datetime(j["due_utc"])
+        author = f"<@{j['author_id']}>" if j.get("author_id") else "someone"
+        repeat_label = f", repeating `{j['recurrence']['rule']}`" if j.get("recurrence") else ""
+        if j["status"] == JobStatus.PENDING:
+            return (f"{author} scheduled message **#{j['id']}** to be sent in <#{j['channel_id']}> on {ts}"
+                f"{repeat_label}.")
+        return f"{author}'s message **#{j['id']}** for <#{j['channel_id']}> on {ts}: {j['status'].value}{repeat_label}."
 
-        await interaction.response.send_message("\n".join(lines), ephemeral=True)
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role: discord.Role):
+        self.permissions.revoke_role(role.guild.id, role.id)
 
     # Server admin authorises a user to use the message queue
     @app_commands.command(name="addauthorizeduser",
                 description="Authorise a user to use the message queue.")
     @app_commands.describe(user="Select a user to authorise.")
+    @app_commands.guild_only()
     async def addauthorizeduser(self, interaction: discord.Interaction, user: discord.User):
         # only allow server admin to use this command
         if not interaction.user.guild_permissions.administrator:
@@ -188,9 +732,7 @@ class MsgQueueCog(commands.Cog):
         )
             return
 
-        if user.id not in self.authorised_users:
-            self.authorised_users.append(user.id)
-            sync_object(self.authorised_users, AUTH_USERS_PATH)
+        if self.permissions.grant_user(interaction.guild.id, user.id):
             await interaction.response.send_message(
                 f"Authorised **{user.mention}** to use message queue."
             )
@@ -204,6 +746,7 @@ class MsgQueueCog(commands.Cog):
     @app_commands.command(name="removeauthorizeduser",
                 description="Remove a user from authorized list for message queue")
     @app_commands.describe(user="Select a user to remove.")
+    @app_commands.guild_only()
     async def removeauthorizeduser(self, interaction: discord.Interaction, user: discord.User):
         # only allow server admin to use this command
         if not interaction.user.guild_permissions.administrator:
@@ -213,9 +756,10 @@ class MsgQueueCog(commands.Cog):
         )
             return
 
-        if user.id in self.authorised_users:
-            self.authorised_users.remove(user.id)
-            sync_object(self.authorised_users, AUTH_USERS_PATH)
+        # a grant from the old global list is removed too, since it would still apply here
+        revoked_in_guild = self.permissions.revoke_user(interaction.guild.id, user.id)
+        revoked_everywhere = self.permissions.revoke_user(None, user.id)
+        if revoked_in_guild or revoked_everywhere:
             await interaction.response.send_message(
                 f"Remove **{user.mention}** from authorized list."
             )
@@ -225,31 +769,93 @@ class MsgQueueCog(commands.Cog):
                 ephemeral=True
             )
 
+    # Server admin authorises everyone with a role to use the message queue
+    @app_commands.command(name="addauthorizedrole",
+                description="Authorise everyone with a role to use the message queue.")
+    @app_commands.describe(role="Select a role to authorise.")
+    @app_commands.guild_only()
+    async def addauthorizedrole(self, interaction: discord.Interaction, role: discord.Role):
+        if not interaction.user.guild_permissions.administrator:
+            return await interaction.response.send_message(
+                "You must be an **administrator** to use this command.", ephemeral=True
+            )
+        if self.permissions.grant_role(interaction.guild.id, role.id):
+            await interaction.response.send_message(f"Authorised **{role.mention}** to use message queue.")
+        else:
+            await interaction.response.send_message(f"{role.mention} is already authorised.", ephemeral=True)
 
-    # ----- helpers for time parsing from notion.py -----
-    # Parse notion time string to datetime object
-    def parse_time_string(self, time_str: str, default_hour = 0, default_minute = 0, default_timezone="Australia/Melbourne"):
-        # Regular expression to check if it's date-only (e.g., 2025-08-22)
-        date_only_pattern = r"^\d{4}-\d{2}-\d{2}$"
-
-        if re.match(date_only_pattern, time_str):
-            # Format 1: 2025-08-22
-            dt = datetime.strptime(time_str, "%Y-%m-%d")
-            dt = pytz.timezone(default_timezone).localize(dt)
-            dt = dt.replace(hour=default_hour, minute=default_minute)
+    # Server admin removes a role from the authorized roles for message queue
+    @app_commands.command(name="removeauthorizedrole",
+                description="Remove a role from authorized roles for message queue")
+    @app_commands.describe(role="Select a role to remove.")
+    @app_commands.guild_only()
+    async def removeauthorizedrole(self, interaction: discord.Interaction, role: discord.Role):
+        if not interaction.user.guild_permissions.administrator:
+            return await interaction.response.send_message(
+                "You must be an **administrator** to use this command.", ephemeral=True
+            )
+        if self.permissions.revoke_role(interaction.guild.id, role.id):
+            await interaction.response.send_message(f"Remove **{role.mention}** from authorized roles.")
         else:
-            # Format 2: 2025-07-24T16:00:00.000+10:00
-            dt = parser.isoparse(time_str)
-            # --- minimal necessary addition: localize naive datetimes ---
-            if dt.tzinfo is None:
-                dt = pytz.timezone(default_timezone).localize(dt)
+            await interaction.response.send_message(
+                f"{role.mention} is not on the authorized roles yet.", ephemeral=True
+            )
+
+    # List who is authorised to use the message queue in this server
+    @app_commands.command(name="listauthorized",
+                description="List users and roles authorized to use the message queue")
+    @app_commands.guild_only()
+    async def listauthorized(self, interaction: discord.Interaction):
+        users = " ".join(f"<@{user_id}>" for user_id in sorted(self.permissions.get_user_grants(interaction.guild.id)))
+        roles = " ".join(f"<@&{role_id}>" for role_id in sorted(self.permissions.get_role_grants(interaction.guild.id)))
+        await interaction.response.send_message(
+            f"Users: {users or 'none'}\nRoles: {roles or 'none'}", ephemeral=True
+        )
+
+
+
+class JobPageView(discord.ui.View):
+    """
+    Previous/next buttons over one index of MsgQueueCog.job_index, MAX_MSGN_DISPLAY jobs per page.
+    Pages start after a cursor (the sort key of the last job of the previous page), so reading
+    a page does not depend on how many jobs there are.
+    """
+    def __init__(self, cog: MsgQueueCog, index_key: tuple, descending: bool, user_id: int):
+        super().__init__(timeout=300)
+        self.cog = cog
+        self.index_key = index_key
+        self.descending = descending
+        self.user_id = user_id
+        # Start cursor of every page up to the current one
+        self.cursors = [None]
+        self.next_cursor = None
+
+    def render(self) -> str:
+        index = self.cog.job_index
+        page = index.get_page(self.index_key, self.cursors[-1], MAX_MSGN_DISPLAY, self.descending)
+        self.next_cursor = page[-1][0] if page else None
+        self.previous_page.disabled = len(self.cursors) == 1
+        self.next_page.disabled = self.next_cursor is None or not index.has_after(
+            self.index_key, self.next_cursor, self.descending)
+        count = index.count(self.index_key)
+        if not page:
+            return "No more messages."
+        first = (len(self.cursors) - 1) * MAX_MSGN_DISPLAY + 1
+        lines = [f"Showing {first}-{first + len(page) - 1} of {count} {self.index_key[1].value} messages:"]
+        lines += [self.cog.format_job_line(job) for _, job in page]
+        return "\n".join(lines)
 
-        return dt
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        return interaction.user.id == self.user_id
 
-    def current_time(self, default_timezone="Australia/Melbourne"):
-        return datetime.now(pytz.timezone(default_timezone))
+    @discord.ui.button(label="Previous", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if len(self.cursors) > 1:
+            self.cursors.pop()
+        await interaction.response.edit_message(content=self.render(), view=self)
 
-    # datetime object to discord timestamp string, e.g. August 5, 2024 4:00 PM
-    def datetime_to_discord_short_datetime(self, dt: datetime) -> str:
-        epoch = round(dt.timestamp())  # Timestamp returns a float so round it
-        return f"<t:{epoch}:f>"
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.primary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if self.next_cursor is not None:
+            self.cursors.append(self.next_cursor)
+        await interaction.response.edit_message(content=self.render(), view=self)
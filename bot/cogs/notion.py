@@ -1,17 +1,24 @@
 # Handle notion features
 
 import discord
-from datetime import datetime, timedelta
-from dateutil import parser
-import pytz
+import asyncio
+import hashlib
+from functools import partial
+from datetime import timedelta
 import re
 from discord.ext import commands, tasks
 from discord import app_commands
 from bot.config import notion_authentication_token, notion_events_database_id, \
-    notion_tasks_database_id, notion_people_database_id
-from bot.utils.memory import load_object, sync_object
-from bot.utils.notion import NotionConnection
-import requests
+    notion_tasks_database_id, notion_people_database_id, notion_cache_ttl_seconds
+from bot.utils.memory import load, load_object, sync_object, remove, load_items, sync_item, sync_items, remove_item, \
+    clear_items, save_blob, load_blob, collect_garbage_blobs
+from bot.utils.notion import NotionConnection, NotionEvent, ParsedPageCache
+from bot.utils.http_cache import HttpCache
+from bot.utils.mutations import Mutation, MutationExecutor
+from bot.utils.timeutil import get_guild_timezone_name, parse_time_string, current_time, \
+    datetime_to_discord_long_date, datetime_to_discord_short_datetime, datetime_to_discord_short_time, \
+    datetime_to_discord_relative_time
+from discord.http import Route
 
 class NotionCog(commands.Cog):
     def __init__(self, bot):
@@ -23,13 +30,28 @@ class NotionCog(commands.Cog):
             tasks_db_id=notion_tasks_database_id,
             people_db_id=notion_people_database_id
             )
+        # Parsed events and tasks, so commands can answer without waiting for Notion
+        self.events_cache = ParsedPageCache(
+            self.notion_connection.get_event_pages,
+            self.parse_notion_event_page,
+            ttl=timedelta(seconds=notion_cache_ttl_seconds))
+        self.tasks_cache = ParsedPageCache(
+            self.notion_connection.get_task_pages,
+            self.parse_notion_task_page,
+            ttl=timedelta(seconds=notion_cache_ttl_seconds))
 
         # Setup file management
 
-        self.discord_managing_event_names_filename = "discord_managing_event_names.pkl"
-        self.discord_managing_event_names = load_object(self.discord_managing_event_names_filename, default_value=[])
-        self.discord_events_thumbnails_filename = "discord_events_thumbnails.pkl"
-        self.discord_events_thumbnails = load_object(self.discord_events_thumbnails_filename, default_value={})
+        # Event name -> fingerprint of the event as last synced to discord (None if the sync failed)
+        self.discord_managing_events_filename = "discord_managing_events"
+        self.discord_managing_events = load_items(self.discord_managing_events_filename)
+        self.migrate_legacy_managing_event_names("discord_managing_event_names.pkl")
+        # Event name -> SHA-256 digest of the thumbnail blob, image bytes are loaded lazily
+        self.discord_events_thumbnails_filename = "discord_events_thumbnails"
+        self.discord_events_thumbnails = load_items(self.discord_events_thumbnails_filename)
+        self.migrate_legacy_thumbnails("discord_events_thumbnails.pkl")
+        self.thumbnails_http_cache = HttpCache("discord_events_thumbnails_http_cache")
+        self.event_mutation_executor = MutationExecutor(max_concurrency=5)
         self.daily_scheduled_time_filename = "daily_scheduled_time.pkl"
         self.daily_scheduled_time = load_object(self.daily_scheduled_time_filename, default_value={"hour": 10, "minute": 0})
         self.last_run_date_filename = "last_run_date.pkl"
@@ -41,44 +63,16 @@ class NotionCog(commands.Cog):
         self.daily_report.start()
         self.hourly_event_update.start()
 
-    def cog_unload(self):
+    async def cog_unload(self):
         self.daily_report.cancel()
         self.hourly_event_update.cancel()
+        await self.thumbnails_http_cache.close()
 
 
-    # Parse notion time string to datetime object
-    def parse_time_string(self, time_str: str, default_hour = 0, default_minute = 0, default_timezone="Australia/Melbourne"):
-        # Regular expression to check if it's date-only (e.g., 2025-08-22)
-        date_only_pattern = r"^\d{4}-\d{2}-\d{2}$"
-
-        if re.match(date_only_pattern, time_str):
-            # Format 1: 2025-08-22
-            dt = datetime.strptime(time_str, "%Y-%m-%d")
-            dt = pytz.timezone(default_timezone).localize(dt)
-            dt = dt.replace(hour=default_hour, minute=default_minute)
-        else:
-            # Format 2: 2025-07-24T16:00:00.000+10:00
-            dt = parser.isoparse(time_str)
-
-        return dt
-
-    def current_time(self, default_timezone="Australia/Melbourne"):
-        return datetime.now(pytz.timezone(default_timezone))
-
-    # datetime object to discord timestamp string, e.g. July 19, 2025
-    def datetime_to_discord_long_date(self, dt: datetime) -> str:
-        epoch = round(dt.timestamp())  # Timestamp returns a float so round it
-        return f"<t:{epoch}:D>"
-
-    # datetime object to discord timestamp string, e.g. August 5, 2024 4:00 PM
-    def datetime_to_discord_short_datetime(self, dt: datetime) -> str:
-        epoch = round(dt.timestamp())  # Timestamp returns a float so round it
-        return f"<t:{epoch}:f>"
-
-    # datetime object to discord timestamp string, e.g. 4:00 PM
-    def datetime_to_discord_short_time(self, dt: datetime) -> str:
-        epoch = round(dt.timestamp())  # Timestamp returns a float so round it
-        return f"<t:{epoch}:t>"
+    # Timezone of the guild reports are posted in
+    def get_report_timezone(self):
+        channel = self.bot.get_channel(self.report_channel_id)
+        return get_guild_timezone_name(None if channel is None else channel.guild.id)
 
     # Parse rich text from Notion for discord markdown with a best-effort approach
     def parse_rich_text(self, rich_text) -> str:
@@ -102,19 +96,19 @@ class NotionCog(commands.Cog):
             output += text
         return output
 
-    # Parse notion event page into {name: Str, start_time: dt obj, end_time: dt obj, description: Str, venue: Str, thumbnail: Str}
+    # Parse notion event page into a NotionEvent
     # or None if failed
-    def parse_notion_event_page(self, page):
+    def parse_notion_event_page(self, page) -> NotionEvent:
         try:
             event_name = self.parse_rich_text(page["properties"]["Event Name"]["title"])
             event_date_object = page["properties"]["Date"]["date"]
             event_start_time_str = event_date_object["start"]
             event_end_time_str = event_date_object["end"]
-            event_start_time_dt = self.parse_time_string(event_start_time_str)
+            event_start_time_dt = parse_time_string(event_start_time_str)
             if event_end_time_str is not None:
-                event_end_time_dt = self.parse_time_string(event_end_time_str, 23, 59)
+                event_end_time_dt = parse_time_string(event_end_time_str, 23, 59)
             else:
-                event_end_time_dt = self.parse_time_string(event_start_time_str, 23, 59) + timedelta(minutes=1)
+                event_end_time_dt = parse_time_string(event_start_time_str, 23, 59) + timedelta(minutes=1)
             event_description = self.parse_rich_text(page["properties"]["Description"]["rich_text"])
             if len(page["properties"]["Venue"]["rich_text"]) > 0:
                 event_venue = self.parse_rich_text(page["properties"]["Venue"]["rich_text"])
@@ -128,42 +122,106 @@ class NotionCog(commands.Cog):
                     event_thumbnail = file_info["file"]["url"]
                 else:
                     event_thumbnail = ""
+                event_thumbnail_signed = file_info["type"] == "file"
             else:
                 event_thumbnail = ""
-            return {"name": event_name,
-                "start_time": event_start_time_dt,
-                "end_time": event_end_time_dt,
-                "description": event_description,
-                "venue": event_venue,
-                "thumbnail": event_thumbnail,
-            }
+                event_thumbnail_signed = False
+            return NotionEvent(name=event_name,
+                start_time=event_start_time_dt,
+                end_time=event_end_time_dt,
+                description=event_description,
+                venue=event_venue,
+                thumbnail=event_thumbnail,
+                thumbnail_signed=event_thumbnail_signed,
+                page_id=page["id"],
+            )
         except Exception as e:
             print(f"Error parsing Notion event page: {e}")
             return None
 
+    # Move the old pickled list of managed event names into keyed items, without fingerprints
+    def migrate_legacy_managing_event_names(self, legacy_filename):
+        legacy_data = load(legacy_filename)
+        if legacy_data is None:
+            return
+        try:
+            new_events = {name: None for name in legacy_data["data"] if name not in self.discord_managing_events}
+            self.discord_managing_events.update(new_events)
+            sync_items(new_events, self.discord_managing_events_filename)
+        except Exception as e:
+            print(f"Error migrating legacy managed event names: {e}")
+        remove(legacy_filename)
+
+    # Move thumbnails from the old pickled {event name: image bytes} dict into blobs
+    def migrate_legacy_thumbnails(self, legacy_filename):
+        legacy_data = load(legacy_filename)
+        if legacy_data is None:
+            return
+        try:
+            for key, image_bytes in legacy_data["data"].items():
+                if key not in self.discord_events_thumbnails:
+                    self.discord_events_thumbnails[key] = save_blob(image_bytes)
+                    sync_item(key, self.discord_events_thumbnails[key], self.discord_events_thumbnails_filename)
+        except Exception as e:
+            print(f"Error migrating legacy thumbnails: {e}")
+        remove(legacy_filename)
+
+    # Thumbnail image bytes of an event, or None if there is none
+    def get_thumbnail(self, key):
+        digest = self.discord_events_thumbnails.get(key)
+        if digest is None:
+            return None
+        return load_blob(digest)
+
     # Update self.discord_events_thumbnails, if url is "" remove the thumbnail instead
-    def update_thumbnail(self, key, url):
+    # Downloads go through the HTTP cache, so unchanged images are not downloaded again
+    # A signed url that has to be downloaded may have expired, so it is fetched again from the page first
+    async def update_thumbnail(self, key, url, signed=False, page_id=""):
         if url == "":
-            self.discord_events_thumbnails.pop(key, None)
-            sync_object(self.discord_events_thumbnails, self.discord_events_thumbnails_filename)
+            if self.discord_events_thumbnails.pop(key, None) is not None:
+                remove_item(key, self.discord_events_thumbnails_filename)
             return
         try:
-            response = requests.get(url)
-            if response.status_code == 200:
-                image_bytes = response.content
-                self.discord_events_thumbnails[key] = image_bytes
-                sync_object(self.discord_events_thumbnails, self.discord_events_thumbnails_filename)
+            if signed and page_id and not self.thumbnails_http_cache.is_cached(url, signed):
+                fresh_event = self.parse_notion_event_page(
+                    await self.notion_connection.refresh_page(self.notion_connection.events_db_id, page_id))
+                if fresh_event is not None and fresh_event.thumbnail:
+                    url = fresh_event.thumbnail
+            digest = await self.thumbnails_http_cache.fetch(url, signed)
+            if digest is not None and self.discord_events_thumbnails.get(key) != digest:
+                self.discord_events_thumbnails[key] = digest
+                sync_item(key, digest, self.discord_events_thumbnails_filename)
         except Exception as e:
             print(f"Error fetching image from URL: {e}")
 
+    # Hash of everything the bot sets on a discord event, the image by its blob digest
+    def get_event_fingerprint(self, notion_event: NotionEvent, thumbnail_digest):
+        fingerprint = hashlib.sha256()
+        for value in (notion_event.name, notion_event.start_time.isoformat(), notion_event.end_time.isoformat(),
+                      notion_event.description, notion_event.venue, thumbnail_digest or ""):
+            fingerprint.update(value.encode())
+            fingerprint.update(b"\0")
+        return fingerprint.hexdigest()
+
+    # Forget which discord events the bot manages
+    def clear_managing_events(self):
+        self.discord_managing_events = {}
+        clear_items(self.discord_managing_events_filename)
+
+    # Forget all thumbnails and delete their blobs
+    def clear_thumbnails(self):
+        self.discord_events_thumbnails = {}
+        clear_items(self.discord_events_thumbnails_filename)
+        self.thumbnails_http_cache.clear()
+        collect_garbage_blobs(())
+
     # Clear all discord event memory
     @app_commands.command(name="cleardiscordeventsmemory",
         description="Clear memory for what discord events the bot is managing. Keyed by discord event name.")
     async def cleardiscordeventsmemory(self, interaction: discord.Interaction):
-        self.discord_managing_event_names = []
-        sync_object(self.discord_managing_event_names, self.discord_managing_event_names_filename)
-        self.discord_events_thumbnails = {}
-        sync_object(self.discord_events_thumbnails, self.discord_events_thumbnails_filename)
+        self.clear_managing_events()
+        self.clear_thumbnails()
+        self.events_cache.invalidate()
         response_string = "Clear complete!"
         await interaction.response.send_message(response_string)
 
@@ -179,14 +237,18 @@ class NotionCog(commands.Cog):
             response_string = "Clearing events:\n"
             count_deleted_events = 0
 
-            for event in scheduled_events:
-                if event.creator_id == bot_user.id:
-                    try:
-                        await event.delete()
-                        count_deleted_events += 1
-                    except Exception as e:
-                        print(f"Failed to delete event {event.name}: {e}")
-                        response_string += "Failed to delete: " + event.name + "\n"
+            mutations = [Mutation(
+                label=event.name,
+                action="Removed",
+                route=Route("DELETE", "/guilds/{guild_id}/scheduled-events/{event_id}",
+                            guild_id=guild.id, event_id=event.id),
+                call=event.delete) for event in scheduled_events if event.creator_id == bot_user.id]
+            for result in await self.event_mutation_executor.run(mutations):
+                if result.ok:
+                    count_deleted_events += 1
+                else:
+                    print(f"Failed to delete event {result.mutation.label}: {result.error}")
+                    response_string += "Failed to delete: " + result.mutation.label + "\n"
 
             response_string += f"Successfully deleted {count_deleted_events} events\n"
 
@@ -199,145 +261,182 @@ class NotionCog(commands.Cog):
             print(f"Error clearing bot events: {e}")
             await interaction.followup.send("An error occurred while trying to delete scheduled events.")
         # Also clear memory
-        self.discord_managing_event_names = []
-        sync_object(self.discord_managing_event_names, self.discord_managing_event_names_filename)
-        self.discord_events_thumbnails = {}
-        sync_object(self.discord_events_thumbnails, self.discord_events_thumbnails_filename)
+        self.clear_managing_events()
+        self.clear_thumbnails()
 
     # Attempt to sync events from notion to guild
+    # Parsed events younger than the cache ttl are reused unless refresh is set
     # Returns update status as string
-    async def sync_bot_events(self, guild: discord.Guild) -> str:
+    async def sync_bot_events(self, guild: discord.Guild, refresh=True) -> str:
         response_string = ""
 
-        # Query notion events
-        try:
-            response_object = await self.notion_connection.get_events_from_notion()
-            assert "results" in response_object, "No results found in the response object"
-        except Exception as e:
-            print(f"Notion fetching Error: {e}")
-            return "Failed to query Notion events, with .env database id and filters."
-
         # Fetch discord events
         try:
             discord_events = {ev.name: ev for ev in await guild.fetch_scheduled_events()}
         except Exception as e:
             print(f"Discord event fetching Error: {e}")
             return "Failed to fetch existing discord events."
-        # Update each notion event
+
+        # Query notion events, each page is parsed once into a NotionEvent record
+        # (and only parsed again after it is edited in Notion)
+        try:
+            if refresh:
+                pages_parsed = await self.events_cache.refresh()
+            else:
+                pages_parsed, _ = await self.events_cache.get_records(wait_if_stale=True)
+        except Exception as e:
+            print(f"Notion fetching Error: {e}")
+            return "Failed to query Notion events, with .env database id and filters."
+        response_string += "Notion events as of " + \
+            datetime_to_discord_relative_time(self.events_cache.refreshed_at) + "\n"
+        # Event name -> new fingerprint for events created or edited in this sync
+        synced_fingerprints = {}
+        notion_events = [notion_event for notion_event in pages_parsed if notion_event is not None]
+        count_unparsed_pages = len(pages_parsed) - len(notion_events)
+
+        # Download all thumbnails concurrently before touching discord
+        thumbnail_urls = [(notion_event.thumbnail, notion_event.thumbnail_signed) for notion_event in notion_events]
+        await asyncio.gather(*[
+            self.update_thumbnail(notion_event.name, notion_event.thumbnail, notion_event.thumbnail_signed,
+                                  notion_event.page_id)
+            for notion_event in notion_events])
+
+        # Work out which discord events to create, edit and delete
         response_string_success = "Updated events:\n"
         response_string_failure = "Failed to update events:\n"
-        has_failure = False
-        for page in response_object["results"]:
+        has_failure = count_unparsed_pages > 0
+        response_string_failure += "- <Unknown Notion Event> (Cannot parse page)\n" * count_unparsed_pages
+        count_skipped_edits = 0
+        mutations = []
+        # Event name -> fingerprint to remember if its mutation succeeds
+        mutation_fingerprints = {}
+        now = current_time()
+        for notion_event in notion_events:
             # Get event properties
-            page_parsed = self.parse_notion_event_page(page)
-            if page_parsed is None:
+            event_name = notion_event.name
+            event_start_time_dt = notion_event.start_time
+            event_end_time_dt = notion_event.end_time
+            event_description = notion_event.description
+            event_venue = notion_event.venue
+
+            if event_end_time_dt < now:
                 has_failure = True
-                response_string_failure += "- <Unknown Notion Event> (Cannot parse page)\n"
+                response_string_failure += f"- {event_name} (End time is in the past)\n"
+                continue
+            if len(event_venue) > 100:
+                has_failure = True
+                response_string_failure += f"- {event_name} (Location string length is greater than 100 characters)\n"
                 continue
-            else:
-                event_name = page_parsed["name"]
-                event_start_time_dt = page_parsed["start_time"]
-                event_end_time_dt = page_parsed["end_time"]
-                event_description = page_parsed["description"]
-                event_venue = page_parsed["venue"]
-                event_thumbnail_url = page_parsed["thumbnail"]
-                self.update_thumbnail(event_name, event_thumbnail_url)
-
-                if event_end_time_dt < self.current_time():
-                    has_failure = True
-                    response_string_failure += f"- {event_name} (End time is in the past)\n"
-                    continue
-                if len(event_venue) > 100:
-                    has_failure = True
-                    response_string_failure += f"- {event_name} (Location string length is greater than 100 characters)\n"
-                    continue
 
+            thumbnail_digest = self.discord_events_thumbnails.get(event_name)
+            fingerprint = self.get_event_fingerprint(notion_event, thumbnail_digest)
             if event_name in discord_events:
-                try:
-                    ev = discord_events[event_name]
-                    edit_kwargs = {}
-                    if ev.start_time != event_start_time_dt:
-                        edit_kwargs["start_time"] = event_start_time_dt
-                    if ev.end_time != event_end_time_dt:
-                        edit_kwargs["end_time"] = event_end_time_dt
-                    if ev.description != event_description:
-                        edit_kwargs["description"] = event_description
-                    if ev.location != event_venue:
-                        edit_kwargs["location"] = event_venue
-                    if (event_name in self.discord_events_thumbnails) or \
-                      (ev.cover_image is not None):
-                        if event_name in self.discord_events_thumbnails:
-                            edit_kwargs["image"] = self.discord_events_thumbnails[event_name]
-                        else:
-                            edit_kwargs["image"] = None
-                    if edit_kwargs:
-                        await ev.edit(**edit_kwargs)
-                        response_string_success += "- " + event_name + " (Edited)\n"
-                    else:
-                        response_string_success += "- " + event_name + " (Unchanged)\n"
-                except Exception as e:
-                    print(f"Discord event editing {event_name} with {edit_kwargs} Error: {e}")
-                    has_failure = True
-                    response_string_failure += "- " + event_name + " (Error when editing existing discord event)\n"
-                    continue
+                ev = discord_events[event_name]
+                edit_kwargs = {}
+                if ev.start_time != event_start_time_dt:
+                    edit_kwargs["start_time"] = event_start_time_dt
+                if ev.end_time != event_end_time_dt:
+                    edit_kwargs["end_time"] = event_end_time_dt
+                if ev.description != event_description:
+                    edit_kwargs["description"] = event_description
+                if ev.location != event_venue:
+                    edit_kwargs["location"] = event_venue
+                # Only upload the image again if the event changed since the last sync,
+                # or if the discord event gained or lost its cover image in the meantime.
+                # A thumbnail that failed to download leaves the cover image as it is.
+                fingerprint_changed = self.discord_managing_events.get(event_name) != fingerprint
+                cover_image_mismatch = (thumbnail_digest is None) != (ev.cover_image is None)
+                thumbnail_unavailable = notion_event.thumbnail != "" and thumbnail_digest is None
+                if not thumbnail_unavailable and (
+                  (fingerprint_changed and (thumbnail_digest is not None or ev.cover_image is not None)) or
+                  cover_image_mismatch):
+                    edit_kwargs["image"] = self.get_thumbnail(event_name)
+                if edit_kwargs:
+                    mutations.append(Mutation(
+                        label=event_name,
+                        action="Edited",
+                        route=Route("PATCH", "/guilds/{guild_id}/scheduled-events/{event_id}",
+                                    guild_id=guild.id, event_id=ev.id),
+                        call=partial(ev.edit, **edit_kwargs)))
+                    mutation_fingerprints[event_name] = fingerprint
+                else:
+                    count_skipped_edits += 1
+                    response_string_success += "- " + event_name + " (Unchanged)\n"
+                    synced_fingerprints[event_name] = fingerprint
             else:
-                try:
-                    if event_name in self.discord_events_thumbnails:
-                        ev = await guild.create_scheduled_event(
-                            name=event_name,
-                            description=event_description,
-                            start_time=event_start_time_dt,
-                            end_time=event_end_time_dt,
-                            entity_type=discord.EntityType.external,
-                            privacy_level=discord.PrivacyLevel.guild_only,
-                            location=event_venue,
-                            image=self.discord_events_thumbnails[event_name],
-                        )
-                    else:
-                        ev = await guild.create_scheduled_event(
-                            name=event_name,
-                            description=event_description,
-                            start_time=event_start_time_dt,
-                            end_time=event_end_time_dt,
-                            entity_type=discord.EntityType.external,
-                            privacy_level=discord.PrivacyLevel.guild_only,
-                            location=event_venue
-                        )
-                    response_string_success += "- " + event_name + " (Created)\n"
-                except Exception as e:
-                    print(f"Discord event creation of {event_name} Error: {e}")
-                    has_failure = True
-                    response_string_failure += "- " + event_name + " (Error when creating new discord event)\n"
-                    continue
+                create_kwargs = {
+                    "name": event_name,
+                    "description": event_description,
+                    "start_time": event_start_time_dt,
+                    "end_time": event_end_time_dt,
+                    "entity_type": discord.EntityType.external,
+                    "privacy_level": discord.PrivacyLevel.guild_only,
+                    "location": event_venue,
+                }
+                event_thumbnail = self.get_thumbnail(event_name)
+                if event_thumbnail is not None:
+                    create_kwargs["image"] = event_thumbnail
+                mutations.append(Mutation(
+                    label=event_name,
+                    action="Created",
+                    route=Route("POST", "/guilds/{guild_id}/scheduled-events", guild_id=guild.id),
+                    call=partial(guild.create_scheduled_event, **create_kwargs)))
+                mutation_fingerprints[event_name] = fingerprint
 
         # Remove unmentioned memorized tracking discord events
-        sync_object(self.discord_managing_event_names, self.discord_managing_event_names_filename)
-        notion_event_names = []
-        for page in response_object["results"]:
-            parsed_page = self.parse_notion_event_page(page)
-            if parsed_page is not None:
-                notion_event_names.append(parsed_page["name"])
-        delete_keys = set(self.discord_managing_event_names) - set(notion_event_names)
+        notion_event_names = [notion_event.name for notion_event in notion_events]
+        delete_keys = set(self.discord_managing_events) - set(notion_event_names)
         for event_name in delete_keys:
             if event_name in discord_events:
-                try:
-                    # Delete the discord event if it exists
-                    ev = discord_events[event_name]
-                    await ev.delete()
-                    response_string_success += "- " + event_name + " (Removed)\n"
-                except Exception as e:
-                    print(f"Removing old event Error: {e}")
-                    has_failure = True
-                    response_string_failure += "- " + event_name + " (Cannot remove the event)\n"
-                self.discord_events_thumbnails.pop(event_name, None)
-                sync_object(self.discord_events_thumbnails, self.discord_events_thumbnails_filename)
+                # Delete the discord event if it exists
+                ev = discord_events[event_name]
+                mutations.append(Mutation(
+                    label=event_name,
+                    action="Removed",
+                    route=Route("DELETE", "/guilds/{guild_id}/scheduled-events/{event_id}",
+                                guild_id=guild.id, event_id=ev.id),
+                    call=ev.delete))
+                if self.discord_events_thumbnails.pop(event_name, None) is not None:
+                    remove_item(event_name, self.discord_events_thumbnails_filename)
             else:
                 response_string_success += "- " + event_name + " (Already removed)\n"
-        self.discord_managing_event_names = notion_event_names
-        sync_object(self.discord_managing_event_names, self.discord_managing_event_names_filename)
+
+        # Run all mutations concurrently, respecting discord rate limit buckets
+        mutation_failure_reasons = {
+            "Created": "Error when creating new discord event",
+            "Edited": "Error when editing existing discord event",
+            "Removed": "Cannot remove the event",
+        }
+        for result in await self.event_mutation_executor.run(mutations):
+            event_name = result.mutation.label
+            action = result.mutation.action
+            latency_ms = round(result.latency * 1000)
+            if result.ok:
+                response_string_success += f"- {event_name} ({action}, {latency_ms} ms)\n"
+                if event_name in mutation_fingerprints:
+                    synced_fingerprints[event_name] = mutation_fingerprints[event_name]
+            else:
+                print(f"Discord event {action.lower()} of {event_name} Error after {result.attempts} attempts: {result.error}")
+                has_failure = True
+                response_string_failure += f"- {event_name} ({mutation_failure_reasons[action]}, {latency_ms} ms)\n"
+                if action == "Edited":
+                    synced_fingerprints[event_name] = None
+
+        # Remember managed events and their fingerprints, writing only entries that changed
+        managing_events = {name: synced_fingerprints.get(name, self.discord_managing_events.get(name))
+                           for name in notion_event_names}
+        changed_events = {name: fingerprint for name, fingerprint in managing_events.items()
+                          if name not in self.discord_managing_events or self.discord_managing_events[name] != fingerprint}
+        sync_items(changed_events, self.discord_managing_events_filename, removed_keys=delete_keys)
+        self.discord_managing_events = managing_events
+        # Delete thumbnail blobs and cached downloads no event refers to anymore
+        self.thumbnails_http_cache.retain(thumbnail_urls)
+        collect_garbage_blobs(set(self.discord_events_thumbnails.values()) | self.thumbnails_http_cache.digests())
 
         # Follow up message
         response_string += response_string_success
+        if count_skipped_edits > 0:
+            response_string += f"Skipped {count_skipped_edits} unchanged events without editing.\n"
         if has_failure:
             response_string += response_string_failure
 
@@ -352,7 +451,7 @@ class NotionCog(commands.Cog):
         await interaction.response.defer()
         guild = interaction.guild
 
-        response_string = await self.sync_bot_events(guild)
+        response_string = await self.sync_bot_events(guild, refresh=False)
 
         paginator = commands.Paginator(prefix="", suffix="")
         for line in response_string.splitlines():
@@ -388,7 +487,7 @@ class NotionCog(commands.Cog):
             task_due_time_str = task_date_object["start"]
             if task_date_object["end"] is not None:
                 task_due_time_str = task_date_object["end"]
-            task_due_time_dt = self.parse_time_string(task_due_time_str, 21, 0)
+            task_due_time_dt = parse_time_string(task_due_time_str, 21, 0)
             task_assignee = [person["name"] for person in page["properties"]["Assignee"]["people"]]
             task_status = page["properties"]["Status"]["status"]["name"]
             return {"name": task_name, "due_time": task_due_time_dt,
@@ -449,14 +548,14 @@ class NotionCog(commands.Cog):
         else:
             return name
 
-    # Fetch notion tasks summary string
-    def fetch_notion_tasks_summary(self, response_object):
+    # Fetch notion tasks summary string from parsed notion task pages
+    def fetch_notion_tasks_summary(self, pages_parsed):
         # Fetch each notion task
         task_count = 0
-        response_string_success = "Tasks due " + self.datetime_to_discord_long_date(self.current_time()) + ":\n"
-        for page in response_object["results"]:
+        now = current_time(self.get_report_timezone())
+        response_string_success = "Tasks due " + datetime_to_discord_long_date(now) + ":\n"
+        for page_parsed in pages_parsed:
             # Get task properties
-            page_parsed = self.parse_notion_task_page(page)
             if page_parsed is None:
                 continue
             task_name = page_parsed["name"]
@@ -464,7 +563,7 @@ class NotionCog(commands.Cog):
             task_assignee = page_parsed["assignee"]
             task_status = page_parsed["status"]
 
-            if task_date_object.date() != self.current_time().date():
+            if task_date_object.date() != now.date():
                 continue
 
             ping_string = " ".join([self.mask_name(name) for name in (task_assignee)]) + "\n"
@@ -477,7 +576,8 @@ class NotionCog(commands.Cog):
     @app_commands.command(name="currenttime",
                           description="Name current time in discord format.")
     async def currenttime(self, interaction: discord.Interaction):
-        response_string = "Current time: " + self.datetime_to_discord_short_datetime(self.current_time())
+        response_string = "Current time: " + datetime_to_discord_short_datetime(
+            current_time(get_guild_timezone_name(interaction.guild_id)))
         await interaction.response.send_message(response_string)
 
     # Format time command
@@ -490,11 +590,11 @@ class NotionCog(commands.Cog):
     async def formattime(self, interaction: discord.Interaction, hours: int, minutes: int):
         try:
             # Build datetime object using today's date and provided time
-            now = self.current_time()
+            now = current_time(get_guild_timezone_name(interaction.guild_id))
             dt = now.replace(hour=hours, minute=minutes, second=0, microsecond=0)
 
             # Format to Discord timestamp using your existing method
-            formatted = self.datetime_to_discord_short_datetime(dt)
+            formatted = datetime_to_discord_short_datetime(dt)
 
             await interaction.response.send_message(f"Formatted time: {formatted}")
         except ValueError as e:
@@ -509,9 +609,9 @@ class NotionCog(commands.Cog):
     )
     async def setdailytime(self, interaction: discord.Interaction, hours: int, minutes: int):
         try:
-            now = self.current_time()
+            now = current_time(self.get_report_timezone())
             dt = now.replace(hour=hours, minute=minutes, second=0, microsecond=0)
-            formatted = self.datetime_to_discord_short_time(dt)
+            formatted = datetime_to_discord_short_time(dt)
             self.daily_scheduled_time = {"hour": hours, "minute": minutes}
             sync_object(self.daily_scheduled_time, self.daily_scheduled_time_filename)
             self.last_run_date = None
@@ -529,17 +629,17 @@ class NotionCog(commands.Cog):
         await interaction.response.defer()
         response_string = ""
 
-        # Query notion tasks
+        # Query notion tasks, answering from the cache and refreshing it in the background when stale
         try:
             response_string += "Filtering by status as In progress or Not started.\n"
-            response_object = await self.notion_connection.get_tasks_from_notion()
-            assert "results" in response_object, "No results found in the response object"
+            pages_parsed, refreshed_at = await self.tasks_cache.get_records()
+            response_string += "Notion tasks as of " + datetime_to_discord_relative_time(refreshed_at) + "\n"
+            task_count, response_string_success = self.fetch_notion_tasks_summary(pages_parsed)
         except Exception as e:
             print(f"Query Notion Tasks Error: {e}")
             await interaction.followup.send("Failed to query Notion tasks, with .env database id and filters.")
             return
 
-        task_count, response_string_success = self.fetch_notion_tasks_summary(response_object)
         # Follow up message
         if task_count == 0:
             response_string += "No tasks due today.\n"
@@ -569,7 +669,7 @@ class NotionCog(commands.Cog):
     @tasks.loop(minutes=1)
     async def daily_report(self):
         try:
-            now = self.current_time()
+            now = current_time(self.get_report_timezone())
             if (now.hour > self.daily_scheduled_time["hour"] or
                (now.hour == self.daily_scheduled_time["hour"] and now.minute >= self.daily_scheduled_time["minute"])):
                 if self.last_run_date is None or self.last_run_date != now.date():
@@ -583,13 +683,12 @@ class NotionCog(commands.Cog):
 
                     # Query notion tasks
                     try:
-                        response_object = await self.notion_connection.get_tasks_from_notion()
-                        assert "results" in response_object, "No results found in the response object"
+                        task_count, response_string = self.fetch_notion_tasks_summary(
+                            await self.tasks_cache.refresh())
                     except Exception as e:
                         print(f"Query Notion Tasks Error: {e}")
                         return
 
-                    task_count, response_string = self.fetch_notion_tasks_summary(response_object)
                     # Follow up message
                     if task_count == 0:
                         return
@@ -4,6 +4,7 @@ import discord
 from discord.ext import commands
 from discord import app_commands
 from bot.utils.memory import clear_memory
+from bot.utils.timeutil import get_guild_timezone_name, set_guild_timezone, current_time
 import pprint
 
 class OthersCog(commands.Cog):
@@ -26,3 +27,19 @@ class OthersCog(commands.Cog):
         response_string = clear_memory()
         response_string = "Clearing memory files:\n" + response_string
         await interaction.response.send_message(response_string)
+
+    # Set the timezone times are read in for this server
+    @app_commands.command(name="settimezone", description="Set the timezone of this server, e.g. Australia/Melbourne.")
+    @app_commands.describe(timezone="IANA timezone name, e.g. Australia/Melbourne")
+    @app_commands.guild_only()
+    async def settimezone(self, interaction: discord.Interaction, timezone: str):
+        if not interaction.user.guild_permissions.administrator:
+            return await interaction.response.send_message(
+                "You must be an **administrator** to use this command.", ephemeral=True
+            )
+        try:
+            set_guild_timezone(interaction.guild_id, timezone)
+        except Exception as e:
+            return await interaction.response.send_message(f"(X) Unknown timezone: {e}", ephemeral=True)
+        now = current_time(get_guild_timezone_name(interaction.guild_id))
+        await interaction.response.send_message(f"Timezone set to **{timezone}**, where it is now {now:%H:%M}.")
@@ -11,3 +11,17 @@ notion_events_database_id = os.getenv("NOTION_EVENTS_DATABASE_ID")
 notion_tasks_database_id = os.getenv("NOTION_TASKS_DATABASE_ID")
 notion_people_database_id = os.getenv("NOTION_PEOPLE_DATABASE_ID")
 openrouter_api_key = os.getenv("OPENROUTER_API_KEY")
+notion_cache_ttl_seconds = int(os.getenv("NOTION_CACHE_TTL_SECONDS", "300"))
+# What to do with scheduled messages that were missed by more than msg_max_lateness_minutes
+# while the bot was offline: "send", "skip" or "summarise"
+msg_catch_up_policy = os.getenv("MSG_CATCH_UP_POLICY", "summarise").strip().lower()
+if msg_catch_up_policy not in ("send", "skip", "summarise"):
+    print(f"[config] unknown MSG_CATCH_UP_POLICY {msg_catch_up_policy!r}, using \"summarise\"")
+    msg_catch_up_policy = "summarise"
+msg_max_lateness_minutes = int(os.getenv("MSG_MAX_LATENESS_MINUTES", "60"))
+# Shared LLM client: requests in flight at once and seconds before a request times out
+llm_max_concurrency = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+llm_timeout_seconds = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+# Cached LLM replies: most replies kept, and days before a reply is asked for again
+llm_cache_max_entries = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+llm_cache_ttl_days = float(os.getenv("LLM_CACHE_TTL_DAYS", "30"))
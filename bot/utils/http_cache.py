@@ -0,0 +1,97 @@
+import os
+import asyncio
+import aiohttp
+from urllib.parse import urlsplit, urlunsplit
+from bot.utils.memory import load_items, sync_item, remove_item, clear_items, save_blob, \
+    get_blob_pathname
+
+class HttpCache:
+    """
+    URL-keyed cache for downloaded files. Bodies are stored as memory blobs and revalidated
+    with If-None-Match/If-Modified-Since, so an unchanged file is never downloaded twice.
+    Requests share one pooled aiohttp session and at most max_concurrency run at once.
+    """
+    def __init__(self, filename="http_cache", timeout=10, max_concurrency=8):
+        self.filename = filename
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.max_concurrency = max_concurrency
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.session = None
+        # Cache key -> {"etag": Str, "last_modified": Str, "digest": Str}
+        self.entries = load_items(self.filename)
+
+    # The session is created on first use, since it must belong to the running event loop
+    def get_session(self):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                timeout=self.timeout,
+                connector=aiohttp.TCPConnector(limit=self.max_concurrency))
+        return self.session
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+
+    # Signed URLs (e.g. Notion-hosted files) rotate their query string every time they are
+    # handed out while the path stays the same for the same file, so only the path is the key
+    def get_cache_key(self, url, signed=False):
+        if not signed:
+            return url
+        parts = urlsplit(url)
+        return urlunsplit((parts.scheme, parts.netloc, parts.path, "", ""))
+
+    def _has_blob(self, entry):
+        return entry is not None and os.path.exists(get_blob_pathname(entry["digest"]))
+
+    # Whether the body of url is cached, so fetching it would not need to download it
+    def is_cached(self, url, signed=False):
+        return self._has_blob(self.entries.get(self.get_cache_key(url, signed)))
+
+    # Fetch url and return the digest of the body blob, or None if it could not be fetched
+    # A signed url that is already cached is not requested at all
+    async def fetch(self, url, signed=False):
+        key = self.get_cache_key(url, signed)
+        entry = self.entries.get(key)
+        if not self._has_blob(entry):
+            entry = None
+        elif signed:
+            return entry["digest"]
+
+        headers = {}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        async with self.semaphore:
+            async with self.get_session().get(url, headers=headers) as response:
+                if response.status == 304 and entry is not None:
+                    return entry["digest"]
+                if response.status != 200:
+                    return None
+                content = await response.read()
+
+        new_entry = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "digest": save_blob(content),
+        }
+        if new_entry != self.entries.get(key):
+            self.entries[key] = new_entry
+            sync_item(key, new_entry, self.filename)
+        return new_entry["digest"]
+
+    # Drop entries of urls that are no longer used
+    def retain(self, urls):
+        keep_keys = {self.get_cache_key(url, signed) for url, signed in urls}
+        for key in [key for key in self.entries if key not in keep_keys]:
+            del self.entries[key]
+            remove_item(key, self.filename)
+
+    # Digests of every cached body, so they are kept when collecting blob garbage
+    def digests(self):
+        return {entry["digest"] for entry in self.entries.values()}
+
+    def clear(self):
+        self.entries = {}
+        clear_items(self.filename)
@@ -0,0 +1,62 @@
+import asyncio
+import importlib.util
+import httpx
+from openai import AsyncOpenAI
+from bot.config import openrouter_api_key, llm_max_concurrency, llm_timeout_seconds
+
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+DEFAULT_MODEL = "google/gemma-3n-e2b-it:free"
+
+class LLMGateway:
+    """
+    Async chat completions over one pooled HTTP client (HTTP/2 when the h2 package is installed),
+    with at most max_concurrency requests in flight and a timeout on each of them.
+    """
+    def __init__(self, base_url=OPENROUTER_BASE_URL, api_key=openrouter_api_key,
+                 max_concurrency=llm_max_concurrency, timeout=llm_timeout_seconds, max_retries=2):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.client = None
+        # Building the client loads TLS certificates, which takes long enough to stall the event loop,
+        # so it is done up front rather than during the first request
+        self.get_client()
+
+    def get_client(self) -> AsyncOpenAI:
+        if self.client is None:
+            http_client = httpx.AsyncClient(
+                http2=importlib.util.find_spec("h2") is not None,
+                limits=httpx.Limits(max_connections=self.max_concurrency,
+                                    max_keepalive_connections=self.max_concurrency),
+                timeout=httpx.Timeout(self.timeout, connect=10))
+            self.client = AsyncOpenAI(base_url=self.base_url, api_key=self.api_key or "none",
+                                      http_client=http_client, max_retries=self.max_retries)
+        return self.client
+
+    # Reply to a list of chat messages, or raise
+    async def complete_messages(self, messages: list, model=DEFAULT_MODEL, **kwargs) -> str:
+        async with self.semaphore:
+            completion = await self.get_client().chat.completions.create(
+                model=model, messages=messages, **kwargs)
+        return completion.choices[0].message.content
+
+    # Reply to a single user prompt, or raise
+    async def complete(self, prompt: str, model=DEFAULT_MODEL, **kwargs) -> str:
+        return await self.complete_messages([{"role": "user", "content": prompt}], model=model, **kwargs)
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.close()
+            self.client = None
+
+_gateway = None
+
+# The gateway shared by every cog
+def get_llm_gateway() -> LLMGateway:
+    global _gateway
+    if _gateway is None:
+        _gateway = LLMGateway()
+    return _gateway
@@ -0,0 +1,112 @@
+import re
+import time
+from collections import OrderedDict
+from bot.config import llm_cache_max_entries, llm_cache_ttl_days
+from bot.utils.memory import load_items, sync_item, sync_items, clear_items
+from bot.utils.write_behind import WriteBehind
+
+class LLMCache:
+    """
+    Persistent memo of LLM replies, keyed by (model, prompt version, normalised input) and stored as
+    memory items. Bump the prompt version of a caller when its prompt changes, so old replies are
+    not reused. Replies older than ttl seconds are asked for again, and past max_entries the least
+    recently used reply is dropped. Last-use times are written behind, since losing one only
+    changes which reply is dropped first.
+    """
+    def __init__(self, filename="llm_cache", max_entries=llm_cache_max_entries,
+                 ttl=llm_cache_ttl_days * 24 * 60 * 60):
+        self.filename = filename
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # Key -> {"reply": Str, "created_at": Float, "last_used": Float}, least recently used first
+        self.entries = OrderedDict()
+        self.touched_keys = set()
+        self.removed_keys = set()
+        self.writer = WriteBehind(self._write_changes, delay=5)
+
+        # Load the most recently used replies that have not expired, and drop the rest
+        now = time.time()
+        dropped_keys = []
+        items = sorted(load_items(self.filename).items(), key=lambda item: item[1]["last_used"], reverse=True)
+        for key, entry in items:
+            if now - entry["created_at"] > self.ttl or len(self.entries) >= self.max_entries:
+                dropped_keys.append(key)
+            else:
+                self.entries[key] = entry
+                self.entries.move_to_end(key, last=False)
+        if dropped_keys:
+            sync_items({}, self.filename, removed_keys=dropped_keys)
+
+    # Case and whitespace do not change what is asked
+    @staticmethod
+    def normalise(text: str) -> str:
+        return re.sub(r"\s+", " ", text).strip().casefold()
+
+    def make_key(self, model: str, version, text: str):
+        return (model, version, self.normalise(text))
+
+    # The cached reply, or None
+    def get(self, model: str, version, text: str):
+        key = self.make_key(model, version, text)
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        now = time.time()
+        if now - entry["created_at"] > self.ttl:
+            self._remove(key)
+            return None
+        entry["last_used"] = now
+        self.entries.move_to_end(key)
+        self.touched_keys.add(key)
+        self.writer.mark_dirty()
+        return entry["reply"]
+
+    def put(self, model: str, version, text: str, reply: str):
+        key = self.make_key(model, version, text)
+        now = time.time()
+        entry = {"reply": reply, "created_at": now, "last_used": now}
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        self.touched_keys.discard(key)
+        self.removed_keys.discard(key)
+        sync_item(key, entry, self.filename)
+        self._evict()
+
+    def _remove(self, key):
+        self.entries.pop(key, None)
+        self.touched_keys.discard(key)
+        self.removed_keys.add(key)
+        self.writer.mark_dirty()
+
+    def _evict(self):
+        while len(self.entries) > self.max_entries:
+            self._remove(next(iter(self.entries)))
+
+    def _write_changes(self):
+        touched = {key: self.entries[key] for key in self.touched_keys if key in self.entries}
+        removed_keys = list(self.removed_keys)
+        self.touched_keys = set()
+        self.removed_keys = set()
+        if touched or removed_keys:
+            sync_items(touched, self.filename, removed_keys=removed_keys)
+
+    def flush(self):
+        self.writer.flush()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        self.entries = OrderedDict()
+        self.touched_keys = set()
+        self.removed_keys = set()
+        clear_items(self.filename)
+
+_cache = None
+
+# The reply cache shared by every cog
+def get_llm_cache() -> LLMCache:
+    global _cache
+    if _cache is None:
+        _cache = LLMCache()
+    return _cache
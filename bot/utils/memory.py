@@ -1,10 +1,22 @@
 import os
 import glob
+import mmap
 import pickle
+import hashlib
+import sqlite3
+import threading
 from datetime import datetime
 from filelock import FileLock, Timeout
 
 memory_directory_name = "working_memory"
+database_filename = "memory.sqlite3"
+blobs_directory_name = "blobs"
+
+# Objects are stored as rows of a single SQLite database (WAL mode), keyed by their
+# historical filename. Keyed items live in their own table so one key can be
+# updated without rewriting the rest of the collection.
+_connection = None
+_connection_lock = threading.RLock()
 
 def get_pathname(filename):
     return os.path.join(memory_directory_name, filename)
@@ -12,48 +24,131 @@ def get_pathname(filename):
 def get_lock_path(pathname):
     return f"{pathname}.lock"
 
-# Load data or return None
-def load(filename):
+# Open (once) the shared memory database
+def get_connection():
+    global _connection
+    with _connection_lock:
+        if _connection is None:
+            if not os.path.exists(memory_directory_name):
+                os.makedirs(memory_directory_name)
+            connection = sqlite3.connect(get_pathname(database_filename), timeout=5,
+                isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("""CREATE TABLE IF NOT EXISTS objects (
+                name TEXT PRIMARY KEY,
+                data BLOB NOT NULL,
+                timestamp REAL NOT NULL)""")
+            connection.execute("""CREATE TABLE IF NOT EXISTS items (
+                name TEXT NOT NULL,
+                key BLOB NOT NULL,
+                data BLOB NOT NULL,
+                PRIMARY KEY (name, key))""")
+            connection.execute("""CREATE TABLE IF NOT EXISTS logs (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                timestamp REAL NOT NULL,
+                data BLOB NOT NULL)""")
+            connection.execute("CREATE INDEX IF NOT EXISTS logs_by_name ON logs (name, seq)")
+            _connection = connection
+        return _connection
+
+# Close the shared memory database, e.g. before deleting the working memory directory
+def close_connection():
+    global _connection
+    with _connection_lock:
+        if _connection is not None:
+            _connection.close()
+            _connection = None
+
+def _dumps(data):
+    return pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+
+# Keys are pickled with a pinned protocol so equal keys always map to equal bytes
+def _dumps_key(key):
+    return pickle.dumps(key, protocol=4)
+
+# Import a pickle file written by the old file-per-object memory, if there is one
+def _migrate_legacy_file(filename):
     pathname = get_pathname(filename)
-    lock_path = get_lock_path(pathname)
-    lock = FileLock(lock_path, timeout=5)
+    if not os.path.exists(pathname):
+        return None
+    lock = FileLock(get_lock_path(pathname), timeout=5)
     try:
         with lock:
-            if os.path.exists(pathname):
-                with open(pathname, "rb") as f:
-                    return pickle.load(f)
-            else:
-                return None
+            with open(pathname, "rb") as f:
+                data = pickle.load(f)
+            _write_object(data, filename)
+            os.remove(pathname)
+            return data
     except Timeout:
-        print(f"Timeout while trying to load {filename}")
+        print(f"Timeout while trying to migrate {filename}")
+    except Exception as e:
+        print(f"Error migrating {filename}: {e}")
+    return None
+
+def _write_object(data, filename, timestamp=None):
+    if timestamp is None:
+        timestamp = datetime.now().timestamp()
+    connection = get_connection()
+    with _connection_lock:
+        connection.execute(
+            "INSERT INTO objects (name, data, timestamp) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET data = excluded.data, timestamp = excluded.timestamp",
+            (filename, _dumps(data), timestamp))
+
+# Load data or return None
+def load(filename):
+    try:
+        connection = get_connection()
+        with _connection_lock:
+            row = connection.execute("SELECT data FROM objects WHERE name = ?", (filename,)).fetchone()
+        if row is None:
+            return _migrate_legacy_file(filename)
+        return pickle.loads(row[0])
+    except sqlite3.OperationalError as e:
+        print(f"Timeout while trying to load {filename}: {e}")
         return None
 
 # Save data
 def save(data, filename):
-    pathname = get_pathname(filename)
-    lock_path = get_lock_path(pathname)
-    lock = FileLock(lock_path, timeout=5)
-    if not os.path.exists(memory_directory_name):
-        os.makedirs(memory_directory_name)
     try:
-        with lock:
-            with open(pathname, "wb") as f:
-                pickle.dump(data, f)
-    except Timeout:
-        print(f"Timeout while trying to save {filename}")
+        _write_object(data, filename)
+    except sqlite3.OperationalError as e:
+        print(f"Timeout while trying to save {filename}: {e}")
+
+# Remove a stored object
+def remove(filename):
+    try:
+        connection = get_connection()
+        with _connection_lock:
+            connection.execute("DELETE FROM objects WHERE name = ?", (filename,))
+    except sqlite3.OperationalError as e:
+        print(f"Timeout while trying to remove {filename}: {e}")
+
+# Timestamp of the last sync of an object, or None if it was never stored
+def _load_timestamp(filename):
+    connection = get_connection()
+    with _connection_lock:
+        row = connection.execute("SELECT timestamp FROM objects WHERE name = ?", (filename,)).fetchone()
+    if row is None:
+        if _migrate_legacy_file(filename) is None:
+            return None
+        return _load_timestamp(filename)
+    return datetime.fromtimestamp(row[0])
 
 # Sync object with memory
+# Only the timestamp is read back unless the stored copy is newer than this process' view
 def sync_object(data, filename):
-    loaded_data = load(filename)
     try:
-        if loaded_data is None or loaded_data["timestamp"] < datetime.now():
+        timestamp = _load_timestamp(filename)
+        if timestamp is None or timestamp < datetime.now():
             newest_data = data
         else:
-            newest_data = loaded_data["data"]
+            newest_data = load(filename)["data"]
     except Exception as e:
         print(f"Error during loading object for syncing: {e}")
         newest_data = data
-    data = newest_data
     save({"timestamp": datetime.now(), "data": newest_data}, filename)
     return newest_data
 
@@ -65,9 +160,198 @@ def load_object(filename, default_value=None):
     except Exception as e:
         print(f"Error during loading object: {e}")
         got_data = default_value
-    save({"timestamp": datetime.now(), "data": got_data}, filename)
+    if loaded_data is None:
+        save({"timestamp": datetime.now(), "data": got_data}, filename)
+    else:
+        try:
+            connection = get_connection()
+            with _connection_lock:
+                connection.execute("UPDATE objects SET timestamp = ? WHERE name = ?",
+                    (datetime.now().timestamp(), filename))
+        except sqlite3.OperationalError as e:
+            print(f"Timeout while trying to refresh {filename}: {e}")
     return got_data
 
+# Keyed items: a collection stored one row per key, so updating a key costs O(1) I/O
+
+# Load all items of a collection as a dict
+def load_items(filename) -> dict:
+    try:
+        connection = get_connection()
+        with _connection_lock:
+            rows = connection.execute("SELECT key, data FROM items WHERE name = ?", (filename,)).fetchall()
+        return {pickle.loads(key): pickle.loads(data) for key, data in rows}
+    except Exception as e:
+        print(f"Error loading items of {filename}: {e}")
+        return {}
+
+# Load a single item of a collection
+def load_item(key, filename, default_value=None):
+    try:
+        connection = get_connection()
+        with _connection_lock:
+            row = connection.execute("SELECT data FROM items WHERE name = ? AND key = ?",
+                (filename, _dumps_key(key))).fetchone()
+        return default_value if row is None else pickle.loads(row[0])
+    except Exception as e:
+        print(f"Error loading item {key} of {filename}: {e}")
+        return default_value
+
+# Insert or replace items, and remove keys, in a single transaction
+def sync_items(items: dict, filename, removed_keys=()):
+    try:
+        connection = get_connection()
+        with _connection_lock:
+            with connection:
+                connection.execute("BEGIN")
+                connection.executemany(
+                    "INSERT INTO items (name, key, data) VALUES (?, ?, ?) "
+                    "ON CONFLICT(name, key) DO UPDATE SET data = excluded.data",
+                    [(filename, _dumps_key(key), _dumps(value)) for key, value in items.items()])
+                connection.executemany("DELETE FROM items WHERE name = ? AND key = ?",
+                    [(filename, _dumps_key(key)) for key in removed_keys])
+    except sqlite3.OperationalError as e:
+        print(f"Timeout while trying to save items of {filename}: {e}")
+
+# Insert or replace a single item
+def sync_item(key, value, filename):
+    sync_items({key: value}, filename)
+
+# Remove a single item
+def remove_item(key, filename):
+    sync_items({}, filename, removed_keys=(key,))
+
+# Remove every item of a collection
+def clear_items(filename):
+    try:
+        connection = get_connection()
+        with _connection_lock:
+            connection.execute("DELETE FROM items WHERE name = ?", (filename,))
+    except sqlite3.OperationalError as e:
+        print(f"Timeout while trying to clear items of {filename}: {e}")
+
+# Logs: append-only collections of entries, e.g. history that is kept around but never updated.
+# Old entries are dropped with trim_log.
+
+# Append entries to a log in a single transaction
+def append_logs(entries, filename):
+    try:
+        timestamp = datetime.now().timestamp()
+        connection = get_connection()
+        with _connection_lock:
+            with connection:
+                connection.execute("BEGIN")
+                connection.executemany("INSERT INTO logs (name, timestamp, data) VALUES (?, ?, ?)",
+                    [(filename, timestamp, _dumps(entry)) for entry in entries])
+    except sqlite3.OperationalError as e:
+        print(f"Timeout while trying to append to log {filename}: {e}")
+
+# Append a single entry to a log
+def append_log(entry, filename):
+    append_logs((entry,), filename)
+
+# Load the latest entries of a log (all of them if limit is None), oldest first
+def load_log(filename, limit=None) -> list:
+    try:
+        connection = get_connection()
+        with _connection_lock:
+            rows = connection.execute(
+                "SELECT data FROM logs WHERE name = ? ORDER BY seq DESC LIMIT ?",
+                (filename, -1 if limit is None else limit)).fetchall()
+        return [pickle.loads(row[0]) for row in reversed(rows)]
+    except Exception as e:
+        print(f"Error loading log {filename}: {e}")
+        return []
+
+# Number of entries in a log
+def count_log(filename) -> int:
+    try:
+        connection = get_connection()
+        with _connection_lock:
+            return connection.execute("SELECT COUNT(*) FROM logs WHERE name = ?", (filename,)).fetchone()[0]
+    except Exception as e:
+        print(f"Error counting log {filename}: {e}")
+        return 0
+
+# Drop entries beyond the latest max_entries and entries older than max_age (a timedelta).
+# Returns the number of entries dropped.
+def trim_log(filename, max_entries=None, max_age=None) -> int:
+    try:
+        connection = get_connection()
+        count_deleted = 0
+        with _connection_lock:
+            with connection:
+                connection.execute("BEGIN")
+                if max_entries is not None:
+                    count_deleted += connection.execute(
+                        "DELETE FROM logs WHERE name = ? AND seq <= ("
+                        "SELECT seq FROM logs WHERE name = ? ORDER BY seq DESC LIMIT 1 OFFSET ?)",
+                        (filename, filename, max_entries)).rowcount
+                if max_age is not None:
+                    count_deleted += connection.execute(
+                        "DELETE FROM logs WHERE name = ? AND timestamp < ?",
+                        (filename, (datetime.now() - max_age).timestamp())).rowcount
+        return count_deleted
+    except sqlite3.OperationalError as e:
+        print(f"Timeout while trying to trim log {filename}: {e}")
+        return 0
+
+# Remove every entry of a log
+def clear_log(filename):
+    try:
+        connection = get_connection()
+        with _connection_lock:
+            connection.execute("DELETE FROM logs WHERE name = ?", (filename,))
+    except sqlite3.OperationalError as e:
+        print(f"Timeout while trying to clear log {filename}: {e}")
+
+# Content-addressed blobs: large byte strings stored once per SHA-256 digest, one file each.
+# Callers keep only the digests in memory and read the bytes back when needed.
+
+def get_blob_pathname(digest):
+    return os.path.join(memory_directory_name, blobs_directory_name, digest[:2], digest)
+
+# Store bytes as a blob and return its digest. Existing blobs are not rewritten.
+def save_blob(data: bytes) -> str:
+    digest = hashlib.sha256(data).hexdigest()
+    pathname = get_blob_pathname(digest)
+    if os.path.exists(pathname):
+        return digest
+    os.makedirs(os.path.dirname(pathname), exist_ok=True)
+    temp_pathname = f"{pathname}.{os.getpid()}.tmp"
+    with open(temp_pathname, "wb") as f:
+        f.write(data)
+    os.replace(temp_pathname, pathname)
+    return digest
+
+# Load the bytes of a blob through mmap, or None if it does not exist
+def load_blob(digest):
+    try:
+        with open(get_blob_pathname(digest), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b""
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return mapped[:]
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Error loading blob {digest}: {e}")
+        return None
+
+# Delete every blob whose digest is not referenced. Returns the number of blobs deleted.
+def collect_garbage_blobs(referenced_digests) -> int:
+    referenced_digests = set(referenced_digests)
+    count_deleted = 0
+    for pathname in glob.glob(os.path.join(memory_directory_name, blobs_directory_name, "*", "*")):
+        if os.path.basename(pathname) in referenced_digests:
+            continue
+        try:
+            os.remove(pathname)
+            count_deleted += 1
+        except Exception as e:
+            print(f"Failed to delete blob: {pathname} - {e}")
+    return count_deleted
+
 # Remove all .lock files
 def remove_all_filelocks():
     lock_files = glob.glob(os.path.join(memory_directory_name, '*.lock'), recursive=True)
@@ -77,9 +361,24 @@ def remove_all_filelocks():
         except Exception as e:
             print(f"Failed to delete lock file: {lock} - {e}")
 
-# Clear all .pkl files in memory
+# Clear all objects, items, logs and blobs in memory, including leftover .pkl files
 def clear_memory():
     response_string = ""
+    try:
+        connection = get_connection()
+        with _connection_lock:
+            names = [row[0] for row in connection.execute(
+                "SELECT name FROM objects UNION SELECT name FROM items UNION SELECT name FROM logs ORDER BY name")]
+            with connection:
+                connection.execute("BEGIN")
+                connection.execute("DELETE FROM objects")
+                connection.execute("DELETE FROM items")
+                connection.execute("DELETE FROM logs")
+        for name in names:
+            response_string += f"Deleted: {name}\n"
+    except sqlite3.OperationalError as e:
+        print(f"Timeout while clearing memory database: {e}")
+        response_string += "Timeout clearing memory database\n"
     pkl_files = glob.glob(os.path.join(memory_directory_name, '*.pkl'), recursive=False)
     for file_path in pkl_files:
         lock_path = get_lock_path(file_path)
@@ -94,6 +393,9 @@ def clear_memory():
         except Exception as e:
             print(f"Error deleting {file_path}: {e}")
             response_string += f"Error deleting: {file_path}\n"
+    count_deleted_blobs = collect_garbage_blobs(())
+    if count_deleted_blobs > 0:
+        response_string += f"Deleted: {count_deleted_blobs} blobs\n"
     return response_string
 
 # Jam-specific helper functions
@@ -129,29 +431,28 @@ def load_jam_data(guild_id: int) -> dict:
 def clear_jam_data(guild_id: int = None):
     """Clear jam data for a guild or all guilds using the new memory system"""
     if guild_id:
-        filename = f"guild_{guild_id}_jam.pkl"
-        pathname = get_pathname(filename)
-        lock_path = get_lock_path(pathname)
-        lock = FileLock(lock_path, timeout=5)
-        try:
-            with lock:
-                if os.path.exists(pathname):
-                    os.remove(pathname)
-        except Timeout:
-            print(f"Timeout while clearing jam data for guild {guild_id}")
-        except Exception as e:
-            print(f"Error clearing jam data for guild {guild_id}: {e}")
+        pattern = f"guild_{guild_id}_jam.pkl"
     else:
-        # Clear all jam files
-        if os.path.exists(memory_directory_name):
-            jam_files = glob.glob(os.path.join(memory_directory_name, 'guild_*_jam.pkl'))
-            for filepath in jam_files:
-                lock_path = get_lock_path(filepath)
-                lock = FileLock(lock_path, timeout=5)
-                try:
-                    with lock:
-                        os.remove(filepath)
-                except Timeout:
-                    print(f"Timeout while clearing {filepath}")
-                except Exception as e:
-                    print(f"Error clearing {filepath}: {e}")
+        pattern = "guild_*_jam.pkl"
+    try:
+        connection = get_connection()
+        with _connection_lock:
+            connection.execute("DELETE FROM objects WHERE name GLOB ?", (pattern,))
+    except sqlite3.OperationalError as e:
+        print(f"Timeout while clearing jam data for {pattern}: {e}")
+    except Exception as e:
+        print(f"Error clearing jam data for {pattern}: {e}")
+
+    # Also clear jam files left over from the file-per-object memory
+    if os.path.exists(memory_directory_name):
+        jam_files = glob.glob(os.path.join(memory_directory_name, pattern))
+        for filepath in jam_files:
+            lock_path = get_lock_path(filepath)
+            lock = FileLock(lock_path, timeout=5)
+            try:
+                with lock:
+                    os.remove(filepath)
+            except Timeout:
+                print(f"Timeout while clearing {filepath}")
+            except Exception as e:
+                print(f"Error clearing {filepath}: {e}")
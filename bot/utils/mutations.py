@@ -0,0 +1,87 @@
+import time
+import random
+import asyncio
+import discord
+from discord.http import Route
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Optional
+
+@dataclass(slots=True)
+class Mutation:
+    """
+    A discord API call that changes something, e.g. creating or editing a scheduled event.
+    """
+    label: str  # What is changed, e.g. the event name
+    action: str  # How it is changed, e.g. "Created"
+    route: Route  # Route of the call, used to find its rate limit bucket
+    call: Callable[[], Awaitable[Any]]
+
+@dataclass(slots=True)
+class MutationResult:
+    mutation: Mutation
+    ok: bool
+    value: Any = None
+    error: Optional[Exception] = None
+    latency: float = 0.0  # Seconds, including rate limit waits and retries
+    attempts: int = 0
+
+class MutationExecutor:
+    """
+    Runs discord mutations concurrently, at most max_concurrency at a time, and reports how long each took.
+    discord.py already waits out and retries 429s per bucket, so a rate limited mutation normally just
+    takes longer. Only when the client has a max_ratelimit_timeout does it raise discord.RateLimited instead;
+    then only the mutations sharing that rate limit bucket (as discord.py keys it) are paused and retried
+    once its retry_after has passed.
+    """
+    def __init__(self, max_concurrency=5, max_attempts=3):
+        self.max_concurrency = max_concurrency
+        self.max_attempts = max_attempts
+        # Bucket key -> time.monotonic() until which the bucket is rate limited
+        self.bucket_blocked_until = {}
+
+    def get_bucket_key(self, route: Route) -> str:
+        return f"{route.key}:{route.major_parameters}"
+
+    # Seconds to wait before retrying a rate limited call, or None if it should not be retried
+    # A 429 that reaches us as an HTTPException is not a bucket limit (discord.py retries those) but e.g.
+    # a Cloudflare ban, which retrying only makes worse
+    def get_retry_after(self, error: Exception, attempt: int) -> Optional[float]:
+        if isinstance(error, discord.RateLimited):
+            return error.retry_after
+        return None
+
+    async def _wait_for_bucket(self, bucket_key):
+        while True:
+            delay = self.bucket_blocked_until.get(bucket_key, 0) - time.monotonic()
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+    async def _run_one(self, mutation: Mutation, semaphore: asyncio.Semaphore) -> MutationResult:
+        bucket_key = self.get_bucket_key(mutation.route)
+        result = MutationResult(mutation=mutation, ok=False)
+        start = time.perf_counter()
+        for attempt in range(1, self.max_attempts + 1):
+            result.attempts = attempt
+            await self._wait_for_bucket(bucket_key)
+            try:
+                async with semaphore:
+                    result.value = await mutation.call()
+                result.ok = True
+                result.error = None
+                break
+            except Exception as e:
+                result.error = e
+                retry_after = self.get_retry_after(e, attempt)
+                if retry_after is None:
+                    break
+                # Back off this bucket only, with some jitter so retries don't arrive together
+                blocked_until = time.monotonic() + retry_after * random.uniform(1.0, 1.2)
+                self.bucket_blocked_until[bucket_key] = max(self.bucket_blocked_until.get(bucket_key, 0), blocked_until)
+        result.latency = time.perf_counter() - start
+        return result
+
+    # Run every mutation and return their results in the same order
+    async def run(self, mutations) -> list:
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        return await asyncio.gather(*[self._run_one(mutation, semaphore) for mutation in mutations])
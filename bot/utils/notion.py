@@ -1,18 +1,51 @@
 from notion_client import AsyncClient
+from notion_client.helpers import async_iterate_paginated_api
 import os
 import asyncio
-from datetime import date
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
 from dotenv import load_dotenv
+from bot.utils.memory import load_items, sync_item, sync_items
+
+@dataclass(slots=True, frozen=True)
+class NotionEvent:
+    """
+    Event parsed from a Notion events database page.
+    """
+    name: str
+    start_time: datetime
+    end_time: datetime
+    description: str
+    venue: str
+    thumbnail: str  # Url, or "" if the event has no thumbnail
+    thumbnail_signed: bool  # Notion-hosted file with an expiring url
+    page_id: str = ""  # Notion page the event was parsed from
 
 class NotionConnection:
     """
     NotionConnection class. Used to decouple the notion connection from other classes/cogs.
+
+    Events and tasks are served from a locally persisted page cache. Each sync only queries pages
+    edited since the data source's last_edited_time watermark, and pages edited since then that no
+    longer match the filter are dropped. A periodic reconciliation pass (ids only) drops pages that
+    were deleted or stopped matching the filter without being edited, e.g. events that are now past.
     """
-    def __init__(self, notion_auth_token, events_db_id="", tasks_db_id="", people_db_id=""):
+    # Notion rounds last_edited_time to the minute, and our clock may differ from Notion's
+    watermark_margin = timedelta(minutes=2)
+
+    def __init__(self, notion_auth_token, events_db_id="", tasks_db_id="", people_db_id="",
+                 reconcile_interval=timedelta(hours=6)):
         self.notion_client = AsyncClient(auth=notion_auth_token)
         self.events_db_id = events_db_id
         self.tasks_db_id = tasks_db_id
         self.people_db_id= people_db_id
+        self.reconcile_interval = reconcile_interval
+        # Data source id -> {"watermark": datetime, "reconciled_at": datetime, "reconciled_on": date}
+        self.sync_states_filename = "notion_sync_states"
+        self.sync_states = load_items(self.sync_states_filename)
+        # Data source id -> {page id: page}, loaded on first use
+        self.page_caches = {}
+        self.sync_locks = {}
 
     def set_events_db_id(self, events_db_id):
         self.events_db_id = events_db_id
@@ -23,8 +56,89 @@ class NotionConnection:
     def set_people_db_id(self, people_db_id):
         self.people_db_id = people_db_id
 
-    async def get_events_from_notion(self):
-        notion_events_filter = {
+    # Yield every page of a data source query as it arrives, following next_cursor
+    async def iterate_query(self, data_source_id, **kwargs):
+        async for page in async_iterate_paginated_api(
+                self.notion_client.data_sources.query,
+                data_source_id=data_source_id,
+                page_size=100,
+                **kwargs):
+            yield page
+
+    # Collect every page of a data source query into a single response object
+    async def collect_query(self, data_source_id, **kwargs):
+        return {"results": [page async for page in self.iterate_query(data_source_id, **kwargs)]}
+
+    def get_page_cache_filename(self, data_source_id):
+        return f"notion_pages_{data_source_id}"
+
+    def get_page_cache(self, data_source_id):
+        if data_source_id not in self.page_caches:
+            self.page_caches[data_source_id] = load_items(self.get_page_cache_filename(data_source_id))
+        return self.page_caches[data_source_id]
+
+    # Bring the page cache of a data source up to date and return it
+    # The first sync loads every matching page, later syncs only pages edited since the watermark
+    async def sync_page_cache(self, data_source_id, query_filter):
+        lock = self.sync_locks.setdefault(data_source_id, asyncio.Lock())
+        async with lock:
+            page_cache = self.get_page_cache(data_source_id)
+            state = self.sync_states.get(data_source_id)
+            started_at = datetime.now(timezone.utc)
+
+            if state is None:
+                changed_pages = {page["id"]: page async for page in self.iterate_query(
+                    data_source_id, filter=query_filter)}
+                removed_page_ids = set(page_cache) - set(changed_pages)
+                reconciled = True
+            else:
+                watermark_filter = {
+                    "timestamp": "last_edited_time",
+                    "last_edited_time": {"on_or_after": state["watermark"].isoformat()}
+                }
+                changed_pages = {page["id"]: page async for page in self.iterate_query(
+                    data_source_id, filter={"and": [query_filter, watermark_filter]})}
+                # Pages edited so they no longer match the filter (e.g. unpublished events, finished
+                # tasks) are not in changed_pages, so edited page ids are asked for without the filter.
+                # Only the title property is requested, this query just needs the page ids
+                edited_page_ids = {page["id"] async for page in self.iterate_query(
+                    data_source_id, filter=watermark_filter, filter_properties=["title"])}
+                removed_page_ids = (edited_page_ids - set(changed_pages)) & set(page_cache)
+                reconciled = (state["reconciled_at"] + self.reconcile_interval <= started_at or
+                              state["reconciled_on"] != date.today())
+                if reconciled:
+                    # Only the title property is requested, this pass just needs the page ids
+                    live_page_ids = {page["id"] async for page in self.iterate_query(
+                        data_source_id, filter=query_filter, filter_properties=["title"])}
+                    removed_page_ids |= set(page_cache) - live_page_ids - set(changed_pages)
+
+            for page_id in removed_page_ids:
+                del page_cache[page_id]
+            page_cache.update(changed_pages)
+            sync_items(changed_pages, self.get_page_cache_filename(data_source_id), removed_keys=removed_page_ids)
+
+            new_state = {
+                "watermark": (started_at - self.watermark_margin).replace(microsecond=0),
+                "reconciled_at": started_at if reconciled else state["reconciled_at"],
+                "reconciled_on": date.today() if reconciled else state["reconciled_on"],
+            }
+            self.sync_states[data_source_id] = new_state
+            sync_item(data_source_id, new_state, self.sync_states_filename)
+            return page_cache
+
+    # Fetch a page again and replace it in the page cache of its data source
+    # Notion-hosted file urls expire about an hour after the page was fetched, so a cached page
+    # that was not edited since holds urls that no longer work
+    async def refresh_page(self, data_source_id, page_id):
+        page = await self.notion_client.pages.retrieve(page_id=page_id)
+        page_cache = self.get_page_cache(data_source_id)
+        if page_id in page_cache:
+            page_cache[page_id] = page
+            sync_item(page_id, page, self.get_page_cache_filename(data_source_id))
+        return page
+
+    def get_events_filter(self):
+        return {
             "and": [
                 {
                     "property": "Is ready for public",
@@ -41,15 +155,8 @@ class NotionConnection:
             ]
         }
 
-        response_object = await self.notion_client.data_sources.query(
-            self.events_db_id,
-            filter=notion_events_filter
-        )
-
-        return response_object
-
-    async def get_tasks_from_notion(self):
-        notion_tasks_completed_filter = {
+    def get_tasks_filter(self):
+        return {
             "or": [
                 {
                     "property": "Status",
@@ -66,17 +173,88 @@ class NotionConnection:
             ]
         }
 
-        response_object = await self.notion_client.data_sources.query(
-                self.tasks_db_id,
-                filter=notion_tasks_completed_filter)
+    # Event and task pages come from the page cache, which is only complete once synced,
+    # so these return every page at once rather than yielding them as they arrive
+    async def get_event_pages(self) -> list:
+        page_cache = await self.sync_page_cache(self.events_db_id, self.get_events_filter())
+        return list(page_cache.values())
+
+    async def get_task_pages(self) -> list:
+        page_cache = await self.sync_page_cache(self.tasks_db_id, self.get_tasks_filter())
+        return list(page_cache.values())
 
-        return response_object
+    def iterate_people_from_notion(self):
+        return self.iterate_query(self.people_db_id)
+
+    async def get_events_from_notion(self):
+        return {"results": await self.get_event_pages()}
+
+    async def get_tasks_from_notion(self):
+        return {"results": await self.get_task_pages()}
 
     async def get_people_from_notion(self):
-        response_object = await self.notion_client.data_sources.query(
-                self.people_db_id)
+        return await self.collect_query(self.people_db_id)
+
+class ParsedPageCache:
+    """
+    Read-through cache of parsed Notion pages. Only the parsed record of each page is kept, keyed by
+    page id and last_edited_time, so a page is parsed again only after it was edited in Notion.
+    Records older than ttl are still served, while a refresh runs in the background.
+    """
+    def __init__(self, get_pages, parse_page, ttl=timedelta(minutes=5)):
+        # get_pages: coroutine function returning a list of notion pages
+        # parse_page: callable turning a notion page into a record, or None if it cannot be parsed
+        self.get_pages = get_pages
+        self.parse_page = parse_page
+        self.ttl = ttl
+        # Page id -> (last_edited_time, record)
+        self.records = {}
+        self.refreshed_at = None
+        self.refresh_task = None
+
+    async def _refresh(self):
+        records = {}
+        for page in await self.get_pages():
+            cached = self.records.get(page["id"])
+            if cached is not None and cached[0] == page["last_edited_time"]:
+                records[page["id"]] = cached
+            else:
+                records[page["id"]] = (page["last_edited_time"], self.parse_page(page))
+        self.records = records
+        self.refreshed_at = datetime.now(timezone.utc)
+
+    def _report_background_error(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Error refreshing parsed Notion pages: {task.exception()}")
+
+    def get_cached_records(self):
+        return [record for _, record in self.records.values()]
+
+    # Refresh now (joining a refresh that is already running) and return the records
+    async def refresh(self):
+        if self.refresh_task is None or self.refresh_task.done():
+            self.refresh_task = asyncio.create_task(self._refresh())
+            self.refresh_task.add_done_callback(self._report_background_error)
+        await asyncio.shield(self.refresh_task)
+        return self.get_cached_records()
+
+    # Return (records, refreshed_at) straight from the cache, only waiting for Notion when
+    # nothing was loaded yet. Records older than the ttl trigger a background refresh,
+    # or are refreshed before returning if wait_if_stale is set.
+    async def get_records(self, wait_if_stale=False):
+        is_stale = self.refreshed_at is not None and datetime.now(timezone.utc) - self.refreshed_at > self.ttl
+        if self.refreshed_at is None or (is_stale and wait_if_stale):
+            await self.refresh()
+        elif is_stale:
+            if self.refresh_task is None or self.refresh_task.done():
+                self.refresh_task = asyncio.create_task(self._refresh())
+                self.refresh_task.add_done_callback(self._report_background_error)
+        return self.get_cached_records(), self.refreshed_at
 
-        return response_object
+    # Forget every record, so the next read waits for a fresh copy from Notion
+    def invalidate(self):
+        self.records = {}
+        self.refreshed_at = None
 
 if __name__ == "__main__":
     load_dotenv()
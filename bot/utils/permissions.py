@@ -0,0 +1,70 @@
+from collections import defaultdict
+from typing import Optional
+from bot.utils.memory import load_items, sync_item, remove_item
+
+class PermissionRegistry:
+    """
+    Per-guild grants of a permission to users and roles, stored as memory items so a grant or
+    revoke writes one row. Grants under guild None apply in every guild.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        # Guild id -> granted user ids / role ids
+        self.user_grants = defaultdict(set)
+        self.role_grants = defaultdict(set)
+        for guild_id, kind, target_id in load_items(self.filename):
+            self._get_grants(kind)[guild_id].add(target_id)
+
+    def _get_grants(self, kind):
+        return self.user_grants if kind == "user" else self.role_grants
+
+    def _grant(self, kind, guild_id: Optional[int], target_id: int) -> bool:
+        grants = self._get_grants(kind)[guild_id]
+        if target_id in grants:
+            return False
+        grants.add(target_id)
+        sync_item((guild_id, kind, target_id), True, self.filename)
+        return True
+
+    def _revoke(self, kind, guild_id: Optional[int], target_id: int) -> bool:
+        grants = self._get_grants(kind).get(guild_id)
+        if not grants or target_id not in grants:
+            return False
+        grants.discard(target_id)
+        remove_item((guild_id, kind, target_id), self.filename)
+        return True
+
+    # Returns False if the user was already granted
+    def grant_user(self, guild_id: Optional[int], user_id: int) -> bool:
+        return self._grant("user", guild_id, user_id)
+
+    # Returns False if the user was not granted
+    def revoke_user(self, guild_id: Optional[int], user_id: int) -> bool:
+        return self._revoke("user", guild_id, user_id)
+
+    def grant_role(self, guild_id: int, role_id: int) -> bool:
+        return self._grant("role", guild_id, role_id)
+
+    def revoke_role(self, guild_id: int, role_id: int) -> bool:
+        return self._revoke("role", guild_id, role_id)
+
+    def get_user_grants(self, guild_id: Optional[int]) -> set:
+        return self.user_grants.get(guild_id, set()) | self.user_grants.get(None, set())
+
+    def get_role_grants(self, guild_id: int) -> set:
+        return set(self.role_grants.get(guild_id, ()))
+
+    # Whether a user (a discord.Member in a guild, a discord.User elsewhere) is granted
+    def is_granted(self, user) -> bool:
+        guild = getattr(user, "guild", None)
+        guild_id = None if guild is None else guild.id
+        if user.id in self.user_grants.get(None, ()):
+            return True
+        if guild_id is None:
+            return False
+        if user.id in self.user_grants.get(guild_id, ()):
+            return True
+        role_grants = self.role_grants.get(guild_id)
+        if not role_grants:
+            return False
+        return not role_grants.isdisjoint(role.id for role in user.roles)
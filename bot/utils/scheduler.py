@@ -0,0 +1,92 @@
+import heapq
+import asyncio
+import itertools
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Hashable
+
+class DeadlineScheduler:
+    """
+    Calls on_due(keys) when scheduled deadlines pass, from a single asyncio task that sleeps until
+    the earliest deadline. Deadlines live in a min-heap; rescheduled or cancelled keys leave stale heap
+    entries behind that are skipped when popped, so both operations are O(log n).
+    """
+    def __init__(self, on_due: Callable[[list], Awaitable[None]], before_start: Callable[[], Awaitable[None]] = None):
+        self.on_due = on_due
+        self.before_start = before_start
+        # Heap of (due_utc, sequence number, key)
+        self.heap = []
+        # Key -> (due_utc, sequence number) of its live heap entry
+        self.deadlines = {}
+        self.counter = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def __contains__(self, key: Hashable):
+        return key in self.deadlines
+
+    def get_deadline(self, key: Hashable):
+        entry = self.deadlines.get(key)
+        return None if entry is None else entry[0]
+
+    # Schedule key at due_utc (timezone-aware), replacing any deadline it already had
+    def schedule(self, key: Hashable, due_utc: datetime):
+        entry = (due_utc, next(self.counter))
+        self.deadlines[key] = entry
+        heapq.heappush(self.heap, (*entry, key))
+        if self.heap[0][2] == key:
+            self.wakeup.set()
+
+    def cancel(self, key: Hashable):
+        if self.deadlines.pop(key, None) is not None:
+            self.wakeup.set()
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    # Drop stale entries from the top of the heap, returning the live top entry or None
+    def _peek(self):
+        while self.heap:
+            due_utc, sequence, key = self.heap[0]
+            if self.deadlines.get(key) == (due_utc, sequence):
+                return self.heap[0]
+            heapq.heappop(self.heap)
+        return None
+
+    # Pop every key whose deadline has passed
+    def _pop_due(self, now_utc: datetime) -> list:
+        keys = []
+        while True:
+            top = self._peek()
+            if top is None or top[0] > now_utc:
+                return keys
+            heapq.heappop(self.heap)
+            del self.deadlines[top[2]]
+            keys.append(top[2])
+
+    async def _run(self):
+        if self.before_start is not None:
+            await self.before_start()
+        while True:
+            self.wakeup.clear()
+            keys = self._pop_due(datetime.now(timezone.utc))
+            if keys:
+                try:
+                    await self.on_due(keys)
+                except Exception as e:
+                    print(f"[scheduler] error while handling due keys {keys}: {e}")
+                continue
+            top = self._peek()
+            timeout = None if top is None else (top[0] - datetime.now(timezone.utc)).total_seconds()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
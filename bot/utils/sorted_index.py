@@ -0,0 +1,69 @@
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
+from typing import Hashable, Iterable, Optional
+
+class SortedIndex:
+    """
+    Secondary index: for every index key, a sorted list of the sort keys of the entries under it.
+    An entry is identified by its sort key, so sort keys must be unique. Adding or removing an entry
+    is O(log n) per index key (plus a list shift), and reading a page is O(log n + page size).
+    """
+    def __init__(self):
+        # Index key -> sorted list of sort keys
+        self.lists = defaultdict(list)
+        # Sort key -> (index keys, value)
+        self.entries = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, sort_key):
+        return sort_key in self.entries
+
+    def add(self, sort_key, index_keys: Iterable[Hashable], value=None):
+        if sort_key in self.entries:
+            self.remove(sort_key)
+        index_keys = tuple(index_keys)
+        self.entries[sort_key] = (index_keys, value)
+        for index_key in index_keys:
+            insort(self.lists[index_key], sort_key)
+
+    def remove(self, sort_key):
+        entry = self.entries.pop(sort_key, None)
+        if entry is None:
+            return
+        for index_key in entry[0]:
+            sort_keys = self.lists[index_key]
+            i = bisect_left(sort_keys, sort_key)
+            if i < len(sort_keys) and sort_keys[i] == sort_key:
+                del sort_keys[i]
+            if not sort_keys:
+                del self.lists[index_key]
+
+    def get(self, sort_key, default=None):
+        entry = self.entries.get(sort_key)
+        return default if entry is None else entry[1]
+
+    def count(self, index_key) -> int:
+        return len(self.lists.get(index_key, ()))
+
+    # Up to limit (sort key, value) pairs under index_key, starting after cursor (a sort key, or None
+    # for the first page), in ascending or descending order
+    def get_page(self, index_key, cursor=None, limit=10, descending=False) -> list:
+        sort_keys = self.lists.get(index_key, [])
+        if descending:
+            end = len(sort_keys) if cursor is None else bisect_left(sort_keys, cursor)
+            page = sort_keys[max(0, end - limit):end][::-1]
+        else:
+            start = 0 if cursor is None else bisect_right(sort_keys, cursor)
+            page = sort_keys[start:start + limit]
+        return [(sort_key, self.entries[sort_key][1]) for sort_key in page]
+
+    # Whether there are entries under index_key past cursor, in the given order
+    def has_after(self, index_key, cursor: Optional[object], descending=False) -> bool:
+        sort_keys = self.lists.get(index_key, [])
+        if cursor is None:
+            return bool(sort_keys)
+        if descending:
+            return bisect_left(sort_keys, cursor) > 0
+        return bisect_right(sort_keys, cursor) < len(sort_keys)
@@ -0,0 +1,136 @@
+from bot.utils.memory import load_items, sync_items, clear_items
+from bot.utils.sorted_index import SortedIndex
+from bot.utils.write_behind import WriteBehind
+
+# Item key of the id of the latest message seen in the thread, stored with the themes so both are
+# written in the same transaction
+LAST_MESSAGE_ID_KEY = "last_message_id"
+
+class ThemeIndex:
+    """
+    Live ranking of the theme suggestions in a theme collection thread, kept up to date from
+    message and reaction events instead of reading the thread's history. Themes are ranked by
+    👍 count (descending), then by when they were posted, and stored as memory items keyed by
+    message id, written behind so a burst of reactions costs one write.
+    The id of the latest message seen is kept too, so messages posted while the bot was offline
+    can be read from the thread's history after it, instead of from the start.
+    """
+    def __init__(self, filename, save_delay=1):
+        self.filename = filename
+        # Message id -> {"original", "reactions", "author", "message_id", "created_at"}
+        self.themes = {}
+        self.ranking = SortedIndex()
+        self.dirty_ids = set()
+        self.removed_ids = set()
+        self.last_message_id_dirty = False
+        self.writer = WriteBehind(self._write_changes, delay=save_delay)
+        items = load_items(self.filename)
+        self.last_message_id = items.pop(LAST_MESSAGE_ID_KEY, None)
+        for message_id, theme in items.items():
+            self.themes[message_id] = theme
+            self.ranking.add(self._get_rank_key(theme), ("all",), message_id)
+
+    def _get_rank_key(self, theme):
+        return (-theme["reactions"], theme["created_at"], theme["message_id"])
+
+    def __len__(self):
+        return len(self.themes)
+
+    def __contains__(self, message_id):
+        return message_id in self.themes
+
+    def get(self, message_id):
+        return self.themes.get(message_id)
+
+    def _changed(self, message_id):
+        self.removed_ids.discard(message_id)
+        self.dirty_ids.add(message_id)
+        self.writer.mark_dirty()
+
+    # Add or replace a theme
+    def add(self, message_id, original, author, created_at, reactions=0):
+        old_theme = self.themes.get(message_id)
+        if old_theme is not None:
+            self.ranking.remove(self._get_rank_key(old_theme))
+        theme = {
+            "original": original,
+            "reactions": reactions,
+            "author": author,
+            "message_id": message_id,
+            "created_at": created_at,
+        }
+        self.themes[message_id] = theme
+        self.ranking.add(self._get_rank_key(theme), ("all",), message_id)
+        self._changed(message_id)
+
+    def remove(self, message_id):
+        theme = self.themes.pop(message_id, None)
+        if theme is None:
+            return
+        self.ranking.remove(self._get_rank_key(theme))
+        self.dirty_ids.discard(message_id)
+        self.removed_ids.add(message_id)
+        self.writer.mark_dirty()
+
+    def edit(self, message_id, original):
+        theme = self.themes.get(message_id)
+        if theme is not None and theme["original"] != original:
+            theme["original"] = original
+            self._changed(message_id)
+
+    # Set the 👍 count of a theme; unknown message ids are ignored
+    def set_reactions(self, message_id, reactions):
+        reactions = max(0, reactions)
+        theme = self.themes.get(message_id)
+        if theme is None or theme["reactions"] == reactions:
+            return
+        self.ranking.remove(self._get_rank_key(theme))
+        theme["reactions"] = reactions
+        self.ranking.add(self._get_rank_key(theme), ("all",), message_id)
+        self._changed(message_id)
+
+    # Change the 👍 count of a theme by delta
+    def add_reactions(self, message_id, delta):
+        theme = self.themes.get(message_id)
+        if theme is not None:
+            self.set_reactions(message_id, theme["reactions"] + delta)
+
+    # Record that every message of the thread up to message_id was seen
+    def see_message(self, message_id):
+        if self.last_message_id is None or message_id > self.last_message_id:
+            self.last_message_id = message_id
+            self.last_message_id_dirty = True
+            self.writer.mark_dirty()
+
+    # Up to limit themes (copies) in rank order, starting after the rank key cursor.
+    # Returns (themes, cursor of the next page)
+    def get_ranked(self, cursor=None, limit=10):
+        page = self.ranking.get_page("all", cursor, limit)
+        themes = [dict(self.themes[message_id]) for _, message_id in page]
+        return themes, (page[-1][0] if page else cursor)
+
+    def _write_changes(self):
+        dirty = {message_id: self.themes[message_id] for message_id in self.dirty_ids if message_id in self.themes}
+        removed_ids = list(self.removed_ids)
+        if self.last_message_id_dirty:
+            dirty[LAST_MESSAGE_ID_KEY] = self.last_message_id
+        self.dirty_ids = set()
+        self.removed_ids = set()
+        self.last_message_id_dirty = False
+        if dirty or removed_ids:
+            sync_items(dirty, self.filename, removed_keys=removed_ids)
+
+    def flush(self):
+        self.writer.flush()
+
+    def clear(self):
+        if self.writer.handle is not None:
+            self.writer.handle.cancel()
+            self.writer.handle = None
+        self.themes = {}
+        self.ranking = SortedIndex()
+        self.dirty_ids = set()
+        self.removed_ids = set()
+        self.last_message_id = None
+        self.last_message_id_dirty = False
+        clear_items(self.filename)
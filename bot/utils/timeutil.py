@@ -0,0 +1,90 @@
+import re
+import pytz
+from functools import lru_cache
+from datetime import datetime, timedelta
+from dateutil import parser
+from bot.utils.memory import load_items, sync_item
+
+DEFAULT_TIMEZONE = "Australia/Melbourne"
+# Guild id -> timezone name, for guilds that set their own
+guild_timezones_filename = "guild_timezones"
+_guild_timezones = None
+
+_date_only_pattern = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+# Timezone objects are built once per name
+@lru_cache(maxsize=None)
+def get_timezone(name=DEFAULT_TIMEZONE):
+    return pytz.timezone(name)
+
+def _load_guild_timezones() -> dict:
+    global _guild_timezones
+    if _guild_timezones is None:
+        _guild_timezones = load_items(guild_timezones_filename)
+    return _guild_timezones
+
+# Timezone name of a guild, the default for guilds that did not set one (or guild_id None)
+def get_guild_timezone_name(guild_id) -> str:
+    if guild_id is None:
+        return DEFAULT_TIMEZONE
+    return _load_guild_timezones().get(guild_id, DEFAULT_TIMEZONE)
+
+# Set the timezone of a guild; raises pytz.UnknownTimeZoneError for unknown names
+def set_guild_timezone(guild_id, name: str):
+    get_timezone(name)
+    _load_guild_timezones()[guild_id] = name
+    sync_item(guild_id, name, guild_timezones_filename)
+
+# pytz localize is slow and the same few dates come up again and again, so they are cached
+@lru_cache(maxsize=4096)
+def _localize_date(date_str: str, hour: int, minute: int, timezone: str) -> datetime:
+    dt = datetime(int(date_str[0:4]), int(date_str[5:7]), int(date_str[8:10]), hour, minute)
+    return get_timezone(timezone).localize(dt)
+
+# Parse a Notion or user time string to a timezone-aware datetime
+# Date-only strings (e.g. 2025-08-22) are at default_hour:default_minute in timezone, and
+# date-times without an offset (e.g. 2025-08-22T16:00) are in timezone.
+# ISO-8601 strings (e.g. 2025-07-24T16:00:00.000+10:00) go through datetime.fromisoformat,
+# falling back to dateutil for forms it does not accept.
+def parse_time_string(time_str: str, default_hour=0, default_minute=0, timezone=DEFAULT_TIMEZONE) -> datetime:
+    if len(time_str) == 10 and _date_only_pattern.fullmatch(time_str):
+        return _localize_date(time_str, default_hour, default_minute, timezone)
+    try:
+        dt = datetime.fromisoformat(time_str)
+    except ValueError:
+        dt = parser.isoparse(time_str)
+    if dt.tzinfo is None:
+        dt = get_timezone(timezone).localize(dt)
+    return dt
+
+def current_time(timezone=DEFAULT_TIMEZONE) -> datetime:
+    return datetime.now(get_timezone(timezone))
+
+# Next time it is hm (HH:MM) in timezone, today or tomorrow
+def next_occurrence_hm(hm: str, timezone=DEFAULT_TIMEZONE) -> datetime:
+    t = datetime.strptime(hm, "%H:%M").time()
+    now = current_time(timezone)
+    candidate = datetime.combine(now.date(), t)
+    if candidate <= now.replace(tzinfo=None):
+        candidate += timedelta(days=1)
+    return get_timezone(timezone).localize(candidate)
+
+# datetime object to discord timestamp string, e.g. July 19, 2025
+def datetime_to_discord_long_date(dt: datetime) -> str:
+    epoch = round(dt.timestamp())  # Timestamp returns a float so round it
+    return f"<t:{epoch}:D>"
+
+# datetime object to discord timestamp string, e.g. August 5, 2024 4:00 PM
+def datetime_to_discord_short_datetime(dt: datetime) -> str:
+    epoch = round(dt.timestamp())
+    return f"<t:{epoch}:f>"
+
+# datetime object to discord timestamp string, e.g. 4:00 PM
+def datetime_to_discord_short_time(dt: datetime) -> str:
+    epoch = round(dt.timestamp())
+    return f"<t:{epoch}:t>"
+
+# datetime object to discord timestamp string, e.g. 2 hours ago
+def datetime_to_discord_relative_time(dt: datetime) -> str:
+    epoch = round(dt.timestamp())
+    return f"<t:{epoch}:R>"
@@ -0,0 +1,33 @@
+import asyncio
+from typing import Callable
+
+class WriteBehind:
+    """
+    Debounces writes to memory: callers buffer their changes and mark them dirty, and write()
+    is called once, delay seconds after the first change, for everything buffered so far.
+    Call flush() to write immediately, e.g. when unloading.
+    """
+    def __init__(self, write: Callable[[], None], delay=0.5):
+        self.write = write
+        self.delay = delay
+        self.handle = None
+
+    def mark_dirty(self):
+        if self.handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Nothing would run the delayed write, so write now
+            self.flush()
+            return
+        self.handle = loop.call_later(self.delay, self.flush)
+
+    def flush(self):
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+        try:
+            self.write()
+        except Exception as e:
+            print(f"[write-behind] write failed: {e}")
@@ -3,9 +3,26 @@
 from bot.config import notion_authentication_token, notion_events_database_id, \
     notion_tasks_database_id, notion_people_database_id
 from bot.utils.notion import NotionConnection
+from contextlib import contextmanager
 import pprint
 import requests
 
+# Point memory at a temporary directory while benchmarks run, so they never touch the bot's memory
+@contextmanager
+def temporary_memory():
+    import tempfile
+    from bot.utils import memory
+
+    old_directory_name = memory.memory_directory_name
+    with tempfile.TemporaryDirectory() as directory_name:
+        memory.close_connection()
+        memory.memory_directory_name = directory_name
+        try:
+            yield directory_name
+        finally:
+            memory.close_connection()
+            memory.memory_directory_name = old_directory_name
+
 async def test_notion_available_databases():
     headers = {
         "Authorization": f"Bearer {notion_authentication_token}",
@@ -58,3 +75,383 @@ async def test_notion_query_event_parse():
     for page in response_object["results"]:
         pprint.pprint(page)
         print("")
+
+# Compare updating one key of a 1k/10k key collection:
+# whole-file pickle rewrite (old memory) against a single keyed item upsert
+async def test_memory_benchmark(updates=200):
+    import os
+    import pickle
+    import time
+    from bot.utils import memory
+
+    with temporary_memory() as directory_name:
+        for key_count in (1000, 10000):
+            data = {f"key_{i}": f"value_{i}" * 4 for i in range(key_count)}
+            pathname = os.path.join(directory_name, f"bench_{key_count}.pkl")
+            with open(pathname, "wb") as f:
+                pickle.dump(data, f)
+            start = time.perf_counter()
+            for i in range(updates):
+                with open(pathname, "rb") as f:
+                    loaded = pickle.load(f)
+                loaded[f"key_{i}"] = "updated"
+                with open(pathname, "wb") as f:
+                    pickle.dump(loaded, f)
+            pickle_time = (time.perf_counter() - start) / updates
+
+            filename = f"bench_{key_count}"
+            memory.sync_items(data, filename)
+            start = time.perf_counter()
+            for i in range(updates):
+                memory.sync_item(f"key_{i}", "updated", filename)
+            item_time = (time.perf_counter() - start) / updates
+
+            print(f"{key_count} keys: pickle rewrite {pickle_time * 1e3:.3f} ms/update, "
+                f"keyed item {item_time * 1e3:.3f} ms/update")
+
+# Serve a fake Notion data source of page_count pages from localhost, and compare
+# streaming the query page by page against collecting the full result set first
+async def test_notion_pagination_benchmark(page_count=5000):
+    import json
+    import time
+    import tracemalloc
+    from aiohttp import web
+    from notion_client import AsyncClient
+
+    pages = [{
+        "object": "page",
+        "id": f"page-{i}",
+        "properties": {"Task Name": {"title": [{"plain_text": f"Task {i}" * 20}]}}
+    } for i in range(page_count)]
+
+    async def query(request):
+        body = await request.json()
+        start = int(body.get("start_cursor") or 0)
+        end = min(start + body.get("page_size", 100), page_count)
+        return web.json_response({
+            "object": "list",
+            "results": pages[start:end],
+            "has_more": end < page_count,
+            "next_cursor": str(end) if end < page_count else None,
+        }, dumps=json.dumps)
+
+    app = web.Application()
+    app.router.add_post("/v1/data_sources/{data_source_id}/query", query)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+
+    # NotionConnection loads its sync state from memory, so keep it away from the bot's memory
+    with temporary_memory():
+        notion = NotionConnection(notion_auth_token="fake", tasks_db_id="tasks")
+        notion.notion_client = AsyncClient(auth="fake", base_url=f"http://127.0.0.1:{port}")
+        try:
+            tracemalloc.start()
+            start = time.perf_counter()
+            response_object = await notion.collect_query(notion.tasks_db_id)
+            first_result_time = time.perf_counter() - start
+            count = len(response_object["results"])
+            del response_object
+            collect_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"Collected: {count} pages, first result after {first_result_time * 1e3:.1f} ms, "
+                f"peak memory {collect_peak / 1e6:.1f} MB")
+
+            tracemalloc.start()
+            start = time.perf_counter()
+            first_result_time = None
+            count = 0
+            async for page in notion.iterate_query(notion.tasks_db_id):
+                if first_result_time is None:
+                    first_result_time = time.perf_counter() - start
+                count += 1
+            stream_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"Streamed: {count} pages, first result after {first_result_time * 1e3:.1f} ms, "
+                f"peak memory {stream_peak / 1e6:.1f} MB")
+        finally:
+            await notion.notion_client.aclose()
+            await runner.cleanup()
+
+# Time the event sync parsing over a synthetic response of page_count Notion event pages:
+# the old two passes (parse for reconciliation, then again for the event names),
+# a single pass into NotionEvent records, and a cached pass where no page changed
+async def test_notion_event_parse_benchmark(page_count=1000, rounds=5):
+    import time
+    from bot.cogs.notion import NotionCog
+    from bot.utils.notion import ParsedPageCache
+
+    def rich_text(text):
+        return [{"plain_text": text, "annotations": {"bold": True}, "href": None}]
+
+    pages = [{
+        "id": f"page-{i}",
+        "last_edited_time": "2025-07-01T00:00:00.000Z",
+        "properties": {
+            "Event Name": {"title": rich_text(f"Event {i}")},
+            "Date": {"date": {"start": "2025-07-24T16:00:00.000+10:00", "end": "2025-07-24T18:00:00.000+10:00"}},
+            "Description": {"rich_text": rich_text("Description " * 10)},
+            "Venue": {"rich_text": rich_text("Venue")},
+            "Thumbnail": {"files": []},
+        }
+    } for i in range(page_count)]
+
+    # Parsing does not touch the cog's state, so skip __init__ and its memory and notion setup
+    cog = NotionCog.__new__(NotionCog)
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        pages_parsed = [cog.parse_notion_event_page(page) for page in pages]
+        notion_event_names = [cog.parse_notion_event_page(page).name for page in pages]
+    two_pass_time = (time.perf_counter() - start) / rounds
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        pages_parsed = [cog.parse_notion_event_page(page) for page in pages]
+        notion_event_names = [notion_event.name for notion_event in pages_parsed]
+    single_pass_time = (time.perf_counter() - start) / rounds
+
+    async def get_pages():
+        return pages
+
+    cache = ParsedPageCache(get_pages, cog.parse_notion_event_page)
+    await cache.refresh()
+    start = time.perf_counter()
+    for _ in range(rounds):
+        pages_parsed = await cache.refresh()
+    cached_time = (time.perf_counter() - start) / rounds
+
+    print(f"{page_count} pages: two passes {two_pass_time * 1e3:.1f} ms, "
+        f"single pass {single_pass_time * 1e3:.1f} ms, unchanged pages from cache {cached_time * 1e3:.1f} ms")
+
+# Save cost per delivered message when many messages are due at once: rewriting the whole
+# queue per delivery, writing each job as it is delivered, and buffering changes in the write-behind
+async def test_msgqueue_persistence_benchmark(deliveries=50, history=2000):
+    import time
+    import pytz
+    from datetime import datetime, timedelta
+    from types import SimpleNamespace
+    from bot.utils import memory
+    from bot.cogs.msgqueueing import MsgQueueCog, JobStatus, MSG_JOBS_PATH, MSG_ARCHIVE_PATH
+
+    def make_job(i, status):
+        return {"id": i, "channel_id": 1, "message": f"message {i}" * 8,
+            "due_utc": datetime.now(pytz.utc) + timedelta(days=1), "status": status, "author_id": 1}
+
+    with temporary_memory() as directory_name:
+        # Every job, including the history of finished ones, in one object
+        jobs = [make_job(i, JobStatus.SENT) for i in range(history)]
+        jobs += [make_job(history + i, JobStatus.PENDING) for i in range(deliveries)]
+        start = time.perf_counter()
+        for job in jobs[history:]:
+            job["status"] = JobStatus.SENT
+            memory.sync_object({"jobs": jobs, "next_id": len(jobs)}, "bench_queue.pkl")
+        rewrite_time = (time.perf_counter() - start) / deliveries
+
+        # One write per delivered job
+        pending = {history + i: make_job(history + i, JobStatus.PENDING) for i in range(deliveries)}
+        memory.sync_items(pending, "bench_jobs")
+        start = time.perf_counter()
+        for job in pending.values():
+            job["status"] = JobStatus.SENT
+            memory.remove_item(job["id"], "bench_jobs")
+            memory.append_log(job, "bench_archive")
+            memory.trim_log("bench_archive", max_entries=1000)
+        per_job_time = (time.perf_counter() - start) / deliveries
+
+        # Write-behind, as MsgQueueCog does
+        async def wait_until_ready():
+            pass
+        cog = MsgQueueCog(SimpleNamespace(wait_until_ready=wait_until_ready))
+        memory.sync_items({history + i: make_job(history + i, JobStatus.PENDING) for i in range(deliveries)},
+            MSG_JOBS_PATH)
+        cog.jobs = memory.load_items(MSG_JOBS_PATH)
+        start = time.perf_counter()
+        for job in list(cog.jobs.values()):
+            job["status"] = JobStatus.SENT
+            cog._archive_job(job)
+        cog.writer.flush()
+        write_behind_time = (time.perf_counter() - start) / deliveries
+        assert not memory.load_items(MSG_JOBS_PATH) and memory.count_log(MSG_ARCHIVE_PATH) == deliveries
+
+        print(f"{deliveries} deliveries: whole queue rewrite {rewrite_time * 1e3:.3f} ms/delivery, "
+            f"per job writes {per_job_time * 1e3:.3f} ms/delivery, "
+            f"write-behind {write_behind_time * 1e3:.3f} ms/delivery")
+
+# Check recurring message series: the first send is the rule's first occurrence, COUNT is
+# respected, occurrences missed while offline are skipped, and UNTIL may be given in UTC
+async def test_msgqueue_recurrence():
+    import pytz
+    from datetime import datetime, timedelta
+    from bot.cogs.msgqueueing import MsgQueueCog
+
+    # Recurrence parsing does not touch the cog's state, so skip __init__
+    cog = MsgQueueCog.__new__(MsgQueueCog)
+    timezone = "Australia/Melbourne"
+    tz = pytz.timezone(timezone)
+
+    def get_series(repeat, start_local):
+        recurrence = cog.parse_recurrence(repeat, start_local, timezone)
+        job = {"recurrence": recurrence, "due_utc": cog.get_first_occurrence(recurrence).astimezone(pytz.utc)}
+        series = [job["due_utc"].astimezone(tz)]
+        while True:
+            next_due_utc = cog.get_next_occurrence(job)
+            if next_due_utc is None:
+                return series
+            job["due_utc"] = next_due_utc
+            series.append(next_due_utc.astimezone(tz))
+
+    # Starting on a Wednesday, a Monday rule first sends on the next Monday, and only COUNT times
+    series = get_series("FREQ=WEEKLY;BYDAY=MO;COUNT=2", tz.localize(datetime(2030, 1, 2, 9)))
+    assert [dt.replace(tzinfo=None) for dt in series] == [datetime(2030, 1, 7, 9), datetime(2030, 1, 14, 9)], series
+
+    # UNTIL in UTC (23:00 UTC on 01-03 is 10:00 on 01-04 in Melbourne) includes the 01-04 occurrence
+    series = get_series("RRULE:FREQ=DAILY;UNTIL=20300103T230000Z", tz.localize(datetime(2030, 1, 1, 9)))
+    assert [dt.day for dt in series] == [1, 2, 3, 4], series
+
+    # A daily series that started long ago continues from the next occurrence after now
+    recurrence = cog.parse_recurrence("daily", tz.localize(datetime(2020, 1, 1, 9)), timezone)
+    job = {"recurrence": recurrence, "due_utc": cog.get_first_occurrence(recurrence).astimezone(pytz.utc)}
+    next_due_utc = cog.get_next_occurrence(job)
+    now_utc = datetime.now(pytz.utc)
+    assert now_utc < next_due_utc <= now_utc + timedelta(days=1, hours=1), next_due_utc
+    assert next_due_utc.astimezone(tz).hour == 9
+
+    # Rules that never occur are rejected
+    try:
+        cog.parse_recurrence("FREQ=DAILY;UNTIL=20290101T000000Z", tz.localize(datetime(2030, 1, 1, 9)), timezone)
+        assert False, "expected a rule without occurrences to be rejected"
+    except ValueError:
+        pass
+    print("Recurrence: first occurrence, COUNT, missed occurrences and UTC UNTIL are handled")
+
+# Parse a mix of Notion date-only and date-time strings with the per-call regex and timezone
+# construction the cogs used to do, and with bot.utils.timeutil
+async def test_timeutil_parse_benchmark(count=100000):
+    import re
+    import time
+    import pytz
+    from datetime import datetime
+    from dateutil import parser
+    from bot.utils.timeutil import parse_time_string
+
+    def old_parse_time_string(time_str, default_hour=0, default_minute=0, default_timezone="Australia/Melbourne"):
+        if re.match(r"^\d{4}-\d{2}-\d{2}$", time_str):
+            dt = datetime.strptime(time_str, "%Y-%m-%d")
+            dt = pytz.timezone(default_timezone).localize(dt)
+            dt = dt.replace(hour=default_hour, minute=default_minute)
+        else:
+            dt = parser.isoparse(time_str)
+        return dt
+
+    time_strs = []
+    for i in range(count):
+        day = f"2025-{i % 12 + 1:02d}-{i % 28 + 1:02d}"
+        if i % 3 == 0:
+            time_strs.append(day)
+        else:
+            time_strs.append(f"{day}T{i % 24:02d}:{i % 60:02d}:00.000+10:00")
+
+    start = time.perf_counter()
+    old_results = [old_parse_time_string(s, 23, 59) for s in time_strs]
+    old_time = time.perf_counter() - start
+    start = time.perf_counter()
+    new_results = [parse_time_string(s, 23, 59) for s in time_strs]
+    new_time = time.perf_counter() - start
+    assert old_results == new_results
+    print(f"{count} strings: old {old_time * 1e3:.0f} ms, timeutil {new_time * 1e3:.0f} ms "
+        f"({old_time / new_time:.1f}x)")
+
+# Serve a fake OpenAI-compatible chat completions endpoint that takes delay seconds per request,
+# and measure how late a 10 ms ticker runs on the event loop during concurrent completions:
+# the old sync client called from a coroutine blocks the loop, the shared gateway does not
+async def test_llm_gateway_responsiveness(request_count=20, delay=0.5):
+    import asyncio
+    import threading
+    import time
+    from aiohttp import web
+    from openai import OpenAI
+    from bot.utils.llm import LLMGateway
+
+    async def chat_completions(request):
+        body = await request.json()
+        await asyncio.sleep(delay)
+        return web.json_response({
+            "id": "fake", "object": "chat.completion", "created": 0, "model": body["model"],
+            "choices": [{"index": 0, "finish_reason": "stop",
+                "message": {"role": "assistant", "content": body["messages"][-1]["content"].upper()}}],
+        })
+
+    # The server runs on its own loop in a thread, so a blocked bot loop does not block it too
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    runner = web.AppRunner(app)
+    server_loop = asyncio.new_event_loop()
+    server_started = threading.Event()
+
+    def serve():
+        asyncio.set_event_loop(server_loop)
+        server_loop.run_until_complete(runner.setup())
+        server_loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", 0).start())
+        server_started.set()
+        server_loop.run_forever()
+
+    server_thread = threading.Thread(target=serve, daemon=True)
+    server_thread.start()
+    server_started.wait()
+    base_url = f"http://127.0.0.1:{runner.addresses[0][1]}/v1"
+
+    # Run requests and return their replies, total time, and the largest delay of a 10 ms ticker meanwhile
+    async def measure_lag(run_requests):
+        max_lag = 0
+        done = False
+
+        async def ticker():
+            nonlocal max_lag
+            while not done:
+                start = time.perf_counter()
+                await asyncio.sleep(0.01)
+                max_lag = max(max_lag, time.perf_counter() - start - 0.01)
+
+        ticker_task = asyncio.create_task(ticker())
+        await asyncio.sleep(0)
+        start = time.perf_counter()
+        replies = await run_requests()
+        total_time = time.perf_counter() - start
+        done = True
+        await ticker_task
+        return replies, total_time, max_lag
+
+    sync_client = OpenAI(base_url=base_url, api_key="fake")
+    gateway = LLMGateway(base_url=base_url, api_key="fake", max_concurrency=request_count)
+    try:
+        # As ItchCog used to: a sync call inside a coroutine
+        sync_count = 4
+
+        async def ask_sync(i):
+            completion = sync_client.chat.completions.create(
+                model="fake", messages=[{"role": "user", "content": f"theme {i}"}])
+            return completion.choices[0].message.content
+
+        async def run_sync():
+            return await asyncio.gather(*[ask_sync(i) for i in range(sync_count)])
+
+        replies, total_time, max_lag = await measure_lag(run_sync)
+        print(f"Sync client: {sync_count} requests in {total_time:.2f}s, "
+            f"event loop blocked up to {max_lag * 1e3:.0f} ms")
+
+        async def run_gateway():
+            return await asyncio.gather(*[gateway.complete(f"theme {i}", model="fake") for i in range(request_count)])
+
+        replies, total_time, max_lag = await measure_lag(run_gateway)
+        assert replies == [f"THEME {i}" for i in range(request_count)]
+        print(f"Gateway: {request_count} requests in {total_time:.2f}s, "
+            f"event loop blocked up to {max_lag * 1e3:.0f} ms")
+    finally:
+        sync_client.close()
+        await gateway.close()
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), server_loop).result()
+        server_loop.call_soon_threadsafe(server_loop.stop)
+        server_thread.join()